@@ -0,0 +1,421 @@
+import argparse
+import sys
+import traceback
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from matching import rank_candidates, AUTO_ACCEPT_THRESHOLD
+from playlist_buffer import PlaylistAddBuffer
+from review_queue import ReviewQueue, REVIEW_DIR, review_index_path
+from sheet_reader import iter_songs, row_duration
+from request_scheduler import scheduler_stats
+from dedupe import DuplicateFilter, NEW, song_key
+from journal import ImportJournal, find_unfinished_journal, DECISION_CHOSEN, DECISION_REVIEW
+from youtube_quota import QuotaTracker, QuotaBudgetExceeded, plan_quota, describe_plan
+from playlist_sync import SyncMap, plan_sync
+from metrics import metrics, recorded_run
+
+SEARCH_WORKERS = 4
+DIRECT_ID_BATCH_SIZE = 50
+# Rows held back behind a row that waits for its bulk lookup, so the playlist keeps the order of the sheet
+HELD_ROWS_LIMIT = 1000
+PROVIDER_NAMES = ("spotify", "youtube")
+
+BatchResult = namedtuple("BatchResult", ["playlist_id", "rows", "added", "review_count", "duplicates", "review_path"])
+SyncResult = namedtuple("SyncResult", ["playlist_id", "rows", "searched", "added", "removed", "moved", "review_count", "review_path"])
+ProviderOutcome = namedtuple("ProviderOutcome", ["provider", "result", "error"])
+
+
+def create_provider(provider_name, quota_budget=None):
+    # Only the SDK of the requested provider is imported, neither needs a display
+    if provider_name == "spotify":
+        from spotify_provider import SpotifyProvider, create_spotify_client, load_spotify_config
+        return SpotifyProvider(create_spotify_client(load_spotify_config(), open_browser=False))
+    from youtube_provider import YoutubeProvider, authenticate_youtube, load_youtube_config
+    youtube, credentials = authenticate_youtube(load_youtube_config(), open_browser=False)
+    return YoutubeProvider(youtube, credentials, QuotaTracker(budget=quota_budget))
+
+
+def print_progress(done, total):
+    print(f"{done} of {total or '?'} rows read", end="\r", flush=True)
+
+
+def search_ahead(provider, rows, workers=SEARCH_WORKERS):
+    # Keeps a bounded window of searches in flight while the sheet is read lazily.
+    # Rows that come with their item are not searched but keep their place, their search results are None.
+    def finish(row, song, item_id, future):
+        if future is None:
+            return row, song, item_id, None
+        with metrics.timed("search wait"):
+            return row, song, item_id, future.result()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for row, song, item_id in rows:
+            future = executor.submit(provider.search, f"{song.artist} {song.title}") if item_id is None else None
+            pending.append((row, song, item_id, future))
+            if len(pending) >= 2 * workers:
+                yield finish(*pending.popleft())
+        while pending:
+            yield finish(*pending.popleft())
+
+
+def batched(iterable, size):
+    batch = []
+    for element in iterable:
+        batch.append(element)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def run_batch_import(provider, songs, playlist_name, description="", threshold=AUTO_ACCEPT_THRESHOLD, review_dir=REVIEW_DIR, sheet_path=None, append=False, song_keys=None, review_index=None):
+    # With a sheet_path every decision is journaled and an unfinished run of the same sheet is continued.
+    # song_keys are the song_key of every row when the caller computed them already,
+    # review_index the index that names the review files of a run into several services.
+    state = find_unfinished_journal(provider.name, sheet_path) if sheet_path else None
+    duplicate_filter = DuplicateFilter()
+    if state is not None:
+        playlist_id = state.playlist_id
+        print(f"Continuing unfinished import into playlist '{state.playlist_name}' ({len(state.decisions)} rows done).")
+    else:
+        playlist_id = provider.find_playlist(playlist_name) if append else None
+    if playlist_id is not None:
+        duplicate_filter.load_playlist(provider, playlist_id)
+    else:
+        playlist_id = provider.create_playlist(playlist_name, description)
+    journal = ImportJournal(provider.name, sheet_path, resume=state is not None) if sheet_path else None
+    if journal is not None and state is None:
+        journal.start(playlist_id, playlist_name)
+
+    add_buffer = PlaylistAddBuffer(
+        lambda ids: provider.add_items(playlist_id, ids), provider.write_chunk_size,
+        on_written=journal.record_written if journal is not None else None
+    )
+    review_queue = ReviewQueue(review_dir, provider.name, playlist_id, index_path=review_index)
+    row_count = 0
+    duplicates = 0
+
+    try:
+        if state is not None:
+            for row, item_id in state.unwritten_choices():
+                row_count += 1
+                # The playlist may have received it right before the stop without the journal noticing
+                if duplicate_filter.claim_item(item_id):
+                    add_buffer.add(item_id, row)
+
+        def resolve_direct(held_rows):
+            # Rows that name their item are verified in bulk instead of searched, unknown IDs are searched
+            direct_ids = [direct_id for _, _, direct_id in held_rows if direct_id is not None]
+            resolved = provider.resolve_items(direct_ids) if direct_ids else {}
+            for row, song, direct_id in held_rows:
+                yield row, song, resolved.get(direct_id)
+
+        def rows_in_order():
+            # (row, song, item ID or None to search it) in sheet order
+            nonlocal duplicates
+            held_rows = []
+            direct_count = 0
+            for row, song in enumerate(songs):
+                # Every row is classified, decided ones too, so the first occurrence stays the same on resume
+                key = song_keys[row] if song_keys is not None else None
+                if duplicate_filter.classify(song.artist, song.title, key) != NEW:
+                    duplicates += 1
+                elif state is None or not state.is_decided(row):
+                    direct_id = provider.direct_item_id(song)
+                    if direct_id is None and not held_rows:
+                        yield row, song, None
+                        continue
+                    held_rows.append((row, song, direct_id))
+                    direct_count += direct_id is not None
+                    if direct_count == DIRECT_ID_BATCH_SIZE or len(held_rows) >= HELD_ROWS_LIMIT:
+                        yield from resolve_direct(held_rows)
+                        held_rows = []
+                        direct_count = 0
+            yield from resolve_direct(held_rows)
+
+        for batch in batched(search_ahead(provider, rows_in_order()), provider.score_batch_size):
+            row_count += len(batch)
+            items_per_song = [
+                provider.search_items(search_results) if search_results is not None else []
+                for _, _, _, search_results in batch
+            ]
+            with metrics.timed("scoring"):
+                scores_per_song = rank_candidates(
+                    provider, [(song.artist, song.title) for _, song, _, _ in batch], items_per_song,
+                    [row_duration(song) for _, song, _, _ in batch]
+                )
+
+            for (row, song, item_id, _), items, scores in zip(batch, items_per_song, scores_per_song):
+                if item_id is None:
+                    query = f"{song.artist} {song.title}"
+                    best = int(scores.argmax()) if items else None
+                    if best is None or scores[best] < threshold:
+                        if best is None:
+                            review_queue.add(song.artist, song.title, query, "no results")
+                        else:
+                            review_queue.add(song.artist, song.title, query, "low confidence", provider.item_id(items[best]), float(scores[best]))
+                        if journal is not None:
+                            journal.record(row, DECISION_REVIEW)
+                        continue
+                    item_id = provider.item_id(items[best])
+                if journal is not None:
+                    journal.record(row, DECISION_CHOSEN, item_id)
+                if duplicate_filter.claim_item(item_id):
+                    add_buffer.add(item_id, row)
+                else:
+                    duplicates += 1
+
+        add_buffer.flush()
+        if journal is not None:
+            journal.finish()
+    finally:
+        try:
+            add_buffer.flush()
+        finally:
+            review_queue.close()
+            if journal is not None:
+                journal.close()
+
+    return BatchResult(playlist_id, row_count, add_buffer.written_count, review_queue.count, duplicates, review_queue.path)
+
+
+def run_sync(provider, songs, playlist_name, description="", threshold=AUTO_ACCEPT_THRESHOLD, review_dir=REVIEW_DIR, song_keys=None, review_index=None):
+    # The playlist is made to match the sheet. Rows the last sync resolved, rows whose song is already
+    # in the playlist and rows that name their item are not searched, so an update costs about one search per new row.
+    playlist_id = provider.find_playlist(playlist_name)
+    if playlist_id is None:
+        playlist_id = provider.create_playlist(playlist_name, description)
+        entries = []
+    else:
+        entries = list(provider.playlist_entries(playlist_id))
+    playlist_index = {}
+    playlist_items = {item_id for _, item_id, _, _ in entries}
+    for _, item_id, artists, title in entries:
+        for artist in artists:
+            playlist_index.setdefault(song_key(artist, title), item_id)
+    sync_map = SyncMap(provider.name, playlist_id)
+
+    # A row is keyed by its song and the identifier it names, a link added to a row resolves it again
+    row_keys = []
+    seen_keys = set()
+    resolved = {}
+    direct_rows = []
+    search_rows = []
+    row_count = 0
+    for row, song in enumerate(songs):
+        row_count += 1
+        direct_id = provider.direct_item_id(song)
+        key = (*(song_keys[row] if song_keys is not None else song_key(song.artist, song.title)), direct_id or "")
+        if key in seen_keys:
+            continue
+        seen_keys.add(key)
+        row_keys.append(key)
+        item_id = sync_map.get(key) or (playlist_index.get(key[:-1]) if direct_id is None else None)
+        if item_id is not None:
+            resolved[key] = item_id
+        elif direct_id is not None:
+            direct_rows.append((key, song, direct_id))
+        else:
+            search_rows.append((key, song))
+
+    for start in range(0, len(direct_rows), DIRECT_ID_BATCH_SIZE):
+        chunk = direct_rows[start:start + DIRECT_ID_BATCH_SIZE]
+        items = provider.resolve_items([direct_id for _, _, direct_id in chunk])
+        for key, song, direct_id in chunk:
+            if direct_id in items:
+                resolved[key] = items[direct_id]
+            else:
+                search_rows.append((key, song))
+
+    review_queue = ReviewQueue(review_dir, provider.name, playlist_id, replace=True, index_path=review_index)
+    try:
+        rows = ((key, song, None) for key, song in search_rows)
+        for batch in batched(search_ahead(provider, rows), provider.score_batch_size):
+            items_per_song = [provider.search_items(search_results) for _, _, _, search_results in batch]
+            with metrics.timed("scoring"):
+                scores_per_song = rank_candidates(
+                    provider, [(song.artist, song.title) for _, song, _, _ in batch], items_per_song,
+                    [row_duration(song) for _, song, _, _ in batch]
+                )
+            for (key, song, _, _), items, scores in zip(batch, items_per_song, scores_per_song):
+                query = f"{song.artist} {song.title}"
+                best = int(scores.argmax()) if items else None
+                # A result already in the playlist was most likely picked by hand from the review file, it stays
+                present = [index for index in range(len(items)) if provider.item_id(items[index]) in playlist_items]
+                if best is not None and scores[best] >= threshold:
+                    resolved[key] = provider.item_id(items[best])
+                elif present:
+                    resolved[key] = provider.item_id(items[max(present, key=lambda index: scores[index])])
+                elif best is None:
+                    review_queue.add(song.artist, song.title, query, "no results", key=key)
+                else:
+                    review_queue.add(
+                        song.artist, song.title, query, "low confidence", provider.item_id(items[best]), float(scores[best]), key=key
+                    )
+    finally:
+        review_queue.close()
+        # Saved before writing, a sync that stops halfway is simply run again
+        sync_map.save(resolved)
+
+    desired = list(dict.fromkeys(resolved[key] for key in row_keys if key in resolved))
+    plan = plan_sync([(entry, item_id) for entry, item_id, _, _ in entries], desired, provider.removes_every_copy)
+    if plan.removals:
+        provider.remove_entries(playlist_id, plan.removals)
+    for entry, item_id, from_position, to_position in plan.moves:
+        provider.move_entry(playlist_id, entry, item_id, from_position, to_position)
+    added = 0
+    for position, item_ids in plan.insertions:
+        for start in range(0, len(item_ids), provider.write_chunk_size):
+            provider.add_items(playlist_id, item_ids[start:start + provider.write_chunk_size], position + start)
+        added += len(item_ids)
+    return SyncResult(playlist_id, row_count, len(search_rows), added, len(plan.removals), len(plan.moves), review_queue.count, review_queue.path)
+
+
+def run_dual_import(providers, songs, playlist_name, description="", threshold=AUTO_ACCEPT_THRESHOLD, review_dir=REVIEW_DIR, sheet_path=None, append=False, sync=False):
+    # The sheet is read and its songs normalized once, then every provider searches and writes on a thread of its own.
+    # Each keeps its own scheduler and rate limit, so the run takes about as long as the slowest provider.
+    # Each writes the review file of its own playlist, one index names them all. A provider that fails does not stop the others.
+    songs = list(songs)
+    song_keys = [song_key(song.artist, song.title) for song in songs]
+    review_index = review_index_path(playlist_name, review_dir)
+
+    def run(provider):
+        if sync:
+            return run_sync(provider, songs, playlist_name, description, threshold, review_dir, song_keys, review_index)
+        return run_batch_import(
+            provider, songs, playlist_name, description, threshold, review_dir, sheet_path, append, song_keys, review_index
+        )
+
+    with ThreadPoolExecutor(max_workers=len(providers)) as executor:
+        futures = [executor.submit(run, provider) for provider in providers]
+    outcomes = []
+    for provider, future in zip(providers, futures):
+        error = future.exception()
+        outcomes.append(ProviderOutcome(provider, None if error is not None else future.result(), error))
+    return outcomes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import an excel file into a playlist without user interaction.")
+    parser.add_argument("file", help="excel, csv or tsv file with artist in the first and title in the second column")
+    parser.add_argument("--provider", choices=[*PROVIDER_NAMES, "both"], required=True,
+                        help="both reads the file once and imports into spotify and youtube at the same time")
+    parser.add_argument("--playlist", required=True, help="name of the playlist to create")
+    parser.add_argument("--description", default="", help="description of the playlist")
+    parser.add_argument("--append", action="store_true",
+                        help="add to your playlist with this name if it exists, songs already in it are skipped")
+    parser.add_argument("--sync", action="store_true",
+                        help="make your playlist with this name match the file: only new rows are searched, "
+                             "removed rows are taken out and the order follows the file")
+    parser.add_argument("--threshold", type=float, default=AUTO_ACCEPT_THRESHOLD,
+                        help="minimum match confidence (0-1) to add the top result automatically")
+    parser.add_argument("--review-dir", default=REVIEW_DIR,
+                        help="songs below the threshold are written to a file per playlist in this directory "
+                             "for review in the GUI")
+    parser.add_argument("--quota-budget", type=int,
+                        help="youtube only: quota units this run may spend, default is what is left of today's quota")
+    parser.add_argument("--metrics", help="write timings per phase, requests per endpoint and cache hit ratios "
+                                          "of this run to this JSON file")
+    parser.add_argument("--prometheus", help="write the same metrics in the Prometheus text format to this file")
+    parser.add_argument("--profile", help="profile this run with cProfile and write the stats to this file")
+    args = parser.parse_args(argv)
+    if args.sync and args.append:
+        parser.error("--sync and --append cannot be combined")
+
+    if args.metrics or args.prometheus:
+        metrics.configure(args.metrics, args.prometheus)
+    names = PROVIDER_NAMES if args.provider == "both" else (args.provider,)
+    providers = [create_provider(name, args.quota_budget) for name in names]
+    details = {"sheet": args.file, "playlist": args.playlist, "provider": args.provider, "mode": "sync" if args.sync else "import"}
+    with recorded_run(details, args.profile):
+        if len(providers) > 1:
+            outcomes = import_into_all(providers, args)
+            for provider, result, error in outcomes:
+                details[provider.name] = result._asdict() if result is not None else {"error": str(error)}
+        else:
+            result = sync(providers[0], args) if args.sync else import_file(providers[0], args)
+            if result is not None:
+                details.update(result._asdict())
+    if len(providers) > 1 and any(error is not None and not isinstance(error, QuotaBudgetExceeded) for _, _, error in outcomes):
+        sys.exit(1)
+
+
+def import_file(provider, args):
+    if args.provider == "youtube":
+        print(describe_plan(plan_quota(provider, iter_songs(args.file), not args.append), provider.quota))
+    try:
+        result = run_batch_import(
+            provider, iter_songs(args.file, print_progress), args.playlist, args.description, args.threshold, args.review_dir,
+            sheet_path=args.file, append=args.append
+        )
+    except QuotaBudgetExceeded as e:
+        print(f"\n{e} Run the same command again to continue where the import stopped.")
+        print(provider.quota.stats())
+        return None
+    print(describe_import(args, result))
+    for line in scheduler_stats():
+        print(line)
+    if args.provider == "youtube":
+        print(provider.quota.stats())
+    return result
+
+
+def sync(provider, args):
+    try:
+        result = run_sync(
+            provider, iter_songs(args.file, print_progress), args.playlist, args.description, args.threshold, args.review_dir
+        )
+    except QuotaBudgetExceeded as e:
+        print(f"\n{e} Run the same command again to finish the sync.")
+        print(provider.quota.stats())
+        return None
+    print(describe_sync(args, result))
+    for line in scheduler_stats():
+        print(line)
+    if args.provider == "youtube":
+        print(provider.quota.stats())
+    return result
+
+
+def import_into_all(providers, args):
+    songs = list(iter_songs(args.file, print_progress))
+    for provider in providers:
+        if provider.name == "youtube" and not args.sync:
+            print(describe_plan(plan_quota(provider, songs, not args.append), provider.quota))
+    outcomes = run_dual_import(
+        providers, songs, args.playlist, args.description, args.threshold, args.review_dir,
+        sheet_path=args.file, append=args.append, sync=args.sync
+    )
+    for provider, result, error in outcomes:
+        if isinstance(error, QuotaBudgetExceeded):
+            print(f"{provider.name}: {error} Run the command again with --provider {provider.name} to continue where it stopped.")
+        elif error is not None:
+            print(f"{provider.name} failed:")
+            traceback.print_exception(type(error), error, error.__traceback__)
+        else:
+            print(f"{provider.name}: {describe_sync(args, result) if args.sync else describe_import(args, result)}")
+    print(f"Open {review_index_path(args.playlist, args.review_dir)} with \"Load review file\" to review the songs of either service.")
+    for line in scheduler_stats():
+        print(line)
+    for provider in providers:
+        if provider.name == "youtube":
+            print(provider.quota.stats())
+    return outcomes
+
+
+def describe_import(args, result):
+    return (f"Playlist '{args.playlist}' ({result.playlist_id}): {result.added} of {result.rows} songs added, "
+            f"{result.review_count} written to {result.review_path} for review, "
+            f"{result.duplicates} duplicates skipped.")
+
+
+def describe_sync(args, result):
+    return (f"Playlist '{args.playlist}' ({result.playlist_id}) synced with {result.rows} rows: {result.searched} searched, "
+            f"{result.added} added, {result.removed} removed, {result.moved} moved, "
+            f"{result.review_count} written to {result.review_path} for review.")
+
+
+if __name__ == "__main__":
+    main()
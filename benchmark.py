@@ -0,0 +1,181 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from fake_server import FakeApi, NOT_FOUND_MARKER, start_server
+
+SIZES = (1000, 10000, 100000)
+PROVIDERS = ("spotify", "youtube")
+RESULT_FILE = "bench_results.json"
+DUPLICATE_SHARE = 0.05
+NOT_FOUND_SHARE = 0.03
+WORDS = ("love", "night", "heart", "fire", "dream", "river", "light", "summer", "shadow", "gold", "rain", "home")
+
+
+def generate_sheet(path, rows, seed=0):
+    # One-word artists so the fake server can split the query, some repeated and some unfindable rows
+    generator = random.Random(seed)
+    songs = []
+    for row in range(rows):
+        if songs and generator.random() < DUPLICATE_SHARE:
+            songs.append(generator.choice(songs))
+            continue
+        title = f"{generator.choice(WORDS).title()} {generator.choice(WORDS).title()} {row}"
+        if generator.random() < NOT_FOUND_SHARE:
+            title += f" {NOT_FOUND_MARKER}"
+        songs.append((f"Band{generator.randrange(rows // 10 + 1)}", title))
+    if path.endswith(".xlsx"):
+        import openpyxl
+        workbook = openpyxl.Workbook(write_only=True)
+        worksheet = workbook.create_sheet()
+        for song in songs:
+            worksheet.append(song)
+        workbook.save(path)
+    else:
+        with open(path, "w", encoding="utf-8", newline="") as sheet_file:
+            csv.writer(sheet_file).writerows(songs)
+
+
+def build_provider(provider_name, base_url):
+    # The real providers and client libraries, only the address and the credentials are fake
+    if provider_name == "spotify":
+        import requests
+        import spotipy
+        from spotify_provider import SpotifyProvider
+        sp = spotipy.Spotify(auth="benchmark", requests_session=requests.Session())
+        sp.prefix = f"{base_url}/v1/"
+        return SpotifyProvider(sp)
+    import googleapiclient.discovery
+    from google.oauth2.credentials import Credentials
+    from youtube_provider import YoutubeProvider
+    from youtube_quota import QuotaTracker
+    credentials = Credentials("benchmark")
+    youtube = googleapiclient.discovery.build(
+        "youtube", "v3", credentials=credentials, static_discovery=True, client_options={"api_endpoint": f"{base_url}/"}
+    )
+    return YoutubeProvider(youtube, credentials, QuotaTracker(daily_quota=10 ** 12))
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if platform.system() == "Darwin" else 1024), 1)
+
+
+def run_case(provider_name, sheet_path, base_url, work_dir, rate_limits):
+    # Runs in its own process, so the peak RSS belongs to this case alone and no cache is shared
+    os.chdir(work_dir)
+    import request_scheduler
+    if not rate_limits:
+        for name in request_scheduler.RATE_LIMITS:
+            request_scheduler.RATE_LIMITS[name] = (1e9, 10 ** 9)
+        # A 429 would still halve the rate down to MIN_RATE, so an injected 429 costs only its Retry-After
+        request_scheduler.MIN_RATE = 1e9
+    from batch_import import run_batch_import
+    from sheet_reader import iter_songs
+
+    started = time.perf_counter()
+    rows = sum(1 for _ in iter_songs(sheet_path))
+    load_seconds = time.perf_counter() - started
+
+    provider = build_provider(provider_name, base_url)
+    started = time.perf_counter()
+    result = run_batch_import(provider, iter_songs(sheet_path), "Benchmark", sheet_path=sheet_path)
+    seconds = time.perf_counter() - started
+    return {
+        "rows": rows,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(rows / seconds, 1),
+        "load_seconds": round(load_seconds, 3),
+        "peak_rss_mb": peak_rss_mb(),
+        "added": result.added,
+        "review": result.review_count,
+        "duplicates": result.duplicates,
+        "scheduler": request_scheduler.scheduler_stats(),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch import benchmark against a local fake of the Spotify and YouTube APIs.")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="comma separated row counts")
+    parser.add_argument("--providers", default=",".join(PROVIDERS))
+    parser.add_argument("--format", choices=["csv", "xlsx"], default="csv", help="format of the generated sheets")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every API request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of API requests answered with 500, on a write this ends the run since writes are not retried")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of API requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=0.1, help="Retry-After of a 429 in seconds")
+    parser.add_argument("--rate-limits", action="store_true",
+                        help="keep the request scheduler's rate limits, by default only the pipeline itself is measured")
+    parser.add_argument("--output", default=RESULT_FILE, help="JSON file the results are written to")
+    args = parser.parse_args(argv)
+
+    api = FakeApi(args.latency, args.error_rate, args.throttle_rate, args.retry_after)
+    server = start_server(api)
+    results = []
+    with tempfile.TemporaryDirectory(prefix="benchmark") as directory:
+        for size in (int(size) for size in args.sizes.split(",")):
+            sheet_path = os.path.join(directory, f"songs_{size}.{args.format}")
+            generate_sheet(sheet_path, size)
+            for provider_name in args.providers.split(","):
+                work_dir = tempfile.mkdtemp(dir=directory)
+                api.reset()
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                    try:
+                        case = executor.submit(
+                            run_case, provider_name, sheet_path, api.base_url, work_dir, args.rate_limits
+                        ).result()
+                    except Exception as e:
+                        case = {"rows": size, "error": str(e)}
+                calls = api.stats()
+                api_calls = sum(count for endpoint, count in calls.items() if endpoint != "images")
+                case.update({
+                    "provider": provider_name,
+                    "api_calls": api_calls,
+                    "calls_per_row": round(api_calls / max(case["rows"], 1), 3),
+                    "calls_by_endpoint": calls,
+                })
+                results.append(case)
+                if "error" in case:
+                    print(f"{provider_name} {size} rows: failed after {api_calls} calls: {case['error']}")
+                else:
+                    print(f"{provider_name} {case['rows']} rows: {case['rows_per_second']} rows/s, "
+                          f"{case['calls_per_row']} calls/row, peak RSS {case['peak_rss_mb']} MB, "
+                          f"sheet loaded in {case['load_seconds']}s")
+    server.shutdown()
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "settings": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as result_file:
+        json.dump(report, result_file, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import re
+from matching import fold
+
+NEW, DUPLICATE, IN_PLAYLIST = range(3)
+
+# Stricter than the matching rules, a row that is taken for a duplicate is never searched
+FEATURED = re.compile(r"\s*[\(\[]\s*(?:feat|ft|featuring)\b[^\)\]]*[\)\]]|\s(?:feat|ft|featuring)\b.*$")
+REMASTER_NOTE = r"(?:(?:19|20)\d{2}\s+)?(?:digital(?:ly)?\s+)?remaster(?:ed)?(?:\s+(?:version|(?:19|20)\d{2}))*"
+REMASTER = re.compile(rf"\s*[\(\[]\s*{REMASTER_NOTE}\s*[\)\]]|\s-\s{REMASTER_NOTE}\s*$")
+
+
+def song_key(artist, title):
+    # Spellings that only differ in case, spacing, accents, featured artists or remaster notes share a key.
+    # Anything else, "(Part 2)" or "(Live)" as much as a different word, makes another song.
+    artist = FEATURED.sub("", fold(artist))
+    title = REMASTER.sub("", FEATURED.sub("", fold(title)))
+    return " ".join(artist.split()), " ".join(title.split())
+
+
+class DuplicateFilter:
+    def __init__(self):
+        self.playlist_keys = set()
+        self.seen_keys = set()
+        self.item_ids = set()
+
+    def load_playlist(self, provider, playlist_id):
+        # Paged bulk read of what the playlist already contains
+        for item_id, artists, title in provider.playlist_songs(playlist_id):
+            self.item_ids.add(item_id)
+            for artist in artists:
+                self.playlist_keys.add(song_key(artist, title))
+
+    def classify(self, artist, title, key=None):
+        # key is song_key(artist, title) when the caller has it already
+        key = key or song_key(artist, title)
+        if key in self.playlist_keys:
+            return IN_PLAYLIST
+        if key in self.seen_keys:
+            return DUPLICATE
+        self.seen_keys.add(key)
+        return NEW
+
+    def claim_item(self, item_id):
+        # Different spellings can still end at the same track or video
+        if item_id in self.item_ids:
+            return False
+        self.item_ids.add(item_id)
+        return True
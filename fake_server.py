@@ -0,0 +1,279 @@
+import argparse
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+RESULTS_PER_SEARCH = 5
+# Titles containing this word find nothing, so the review path is exercised too
+NOT_FOUND_MARKER = "unfindable"
+# 1x1 PNG served for every cover and thumbnail
+PIXEL_PNG = base64.b64decode("iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII=")
+
+
+class FakeApi:
+    # State and counters of the stand-in services, shared by all request threads
+    def __init__(self, latency=0.0, error_rate=0.0, throttle_rate=0.0, retry_after=0.1, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.playlists = {}
+        self.base_url = ""
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+            self.playlists.clear()
+
+    def count(self, endpoint):
+        with self.lock:
+            self.calls[endpoint] += 1
+
+    def fault(self):
+        # None, or the status code the request fails with
+        with self.lock:
+            draw = self.random.random()
+        if draw < self.throttle_rate:
+            return 429
+        if draw < self.throttle_rate + self.error_rate:
+            return 500
+        return None
+
+    def new_playlist(self, name):
+        with self.lock:
+            playlist_id = f"pl{len(self.playlists) + 1}"
+            self.playlists[playlist_id] = {"name": name, "items": []}
+            return playlist_id
+
+    def playlist_items(self, playlist_id):
+        with self.lock:
+            return list(self.playlists.get(playlist_id, {"items": []})["items"])
+
+    def insert_items(self, playlist_id, item_ids, position=None):
+        with self.lock:
+            items = self.playlists.setdefault(playlist_id, {"name": "", "items": []})["items"]
+            position = len(items) if position is None else position
+            items[position:position] = item_ids
+            return len(items)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.calls)
+
+
+def split_query(query):
+    # The benchmark sheets use one-word artists, so "artist title" splits at the first space
+    artist, _, title = query.partition(" ")
+    return artist, title
+
+
+def item_key(text):
+    # Hex is valid in Spotify IDs and YouTube video IDs
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:22]
+
+
+def spotify_track(api, artist, title, rank):
+    track_id = item_key(f"{rank}{artist}{title}")
+    return {
+        "uri": f"spotify:track:{track_id}",
+        "id": track_id,
+        "name": title if rank == 0 else f"{title} (Karaoke Version {rank})",
+        "artists": [{"name": artist if rank == 0 else f"Cover Band {rank}"}],
+        "duration_ms": 200000 + rank * 1000,
+        "album": {"images": [{"url": f"{api.base_url}/images/{track_id}.png", "width": 64, "height": 64}]},
+    }
+
+
+def youtube_video(api, artist, title, rank):
+    video_id = item_key(f"{rank}{artist}{title}")[:11]
+    return {
+        "id": {"kind": "youtube#video", "videoId": video_id},
+        "snippet": {
+            "title": f"{artist} - {title}" if rank == 0 else f"{title} (cover {rank})",
+            "channelTitle": artist if rank == 0 else f"Cover Band {rank}",
+            "thumbnails": {"default": {"url": f"{api.base_url}/images/{video_id}.png"}},
+        },
+    }
+
+
+def search_results(api, query, make_item):
+    artist, title = split_query(query)
+    if NOT_FOUND_MARKER in title:
+        return []
+    return [make_item(api, artist, title, rank) for rank in range(RESULTS_PER_SEARCH)]
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, with Nagle every keep-alive response would wait for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_PUT(self):
+        self.handle_request("PUT")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+    def handle_request(self, method):
+        api = self.server.api
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}") if length else {}
+
+        if parts[:1] == ["images"]:
+            api.count("images")
+            return self.send(200, PIXEL_PNG, "image/png")
+
+        if parts[:1] == ["v1"]:
+            route = spotify_route(method, parts[1:])
+        elif parts[:2] == ["youtube", "v3"]:
+            route = youtube_route(method, parts[2:])
+        else:
+            route = None
+        if route is None:
+            return self.send_json(404, {"error": {"status": 404, "message": f"no fake for {method} {url.path}"}})
+        endpoint, respond = route
+        api.count(endpoint)
+
+        if api.latency:
+            time.sleep(api.latency)
+        status = api.fault()
+        if status == 429:
+            return self.send_json(429, {"error": {"code": 429, "message": "rate limited"}}, {"Retry-After": str(api.retry_after)})
+        if status is not None:
+            return self.send_json(status, {"error": {"code": status, "message": "injected error"}})
+        self.send_json(200, respond(api, parts, query, body))
+
+    def send_json(self, status, payload, headers=None):
+        self.send(status, json.dumps(payload).encode("utf-8"), "application/json", headers)
+
+    def send(self, status, content, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def spotify_add(api, parts, query, body):
+    # The URIs come as a plain list or in "uris", the position in the body or the query
+    if isinstance(body, list):
+        uris, position = body, query.get("position")
+    else:
+        uris, position = body.get("uris", []), body.get("position", query.get("position"))
+    position = int(position) if position is not None else None
+    return {"snapshot_id": str(api.insert_items(parts[1], uris, position))}
+
+
+def spotify_route(method, parts):
+    # Newer spotipy versions use /items where older ones use /tracks
+    if method == "GET" and parts == ["search"]:
+        return "spotify search", lambda api, parts, query, body: {
+            "tracks": {"items": search_results(api, query.get("q", ""), spotify_track), "next": None}
+        }
+    if method == "GET" and parts == ["me"]:
+        return "spotify me", lambda api, parts, query, body: {"id": "benchmark"}
+    if method == "GET" and parts == ["me", "playlists"]:
+        return "spotify playlists", lambda api, parts, query, body: {"items": [], "next": None}
+    if method == "POST" and len(parts) == 3 and parts[0] == "users" and parts[2] == "playlists":
+        return "spotify playlist create", lambda api, parts, query, body: {"id": api.new_playlist(body.get("name", ""))}
+    if method == "POST" and len(parts) == 3 and parts[0] == "playlists" and parts[2] in ("tracks", "items"):
+        return "spotify playlist add", spotify_add
+    if method == "GET" and len(parts) == 3 and parts[0] == "playlists" and parts[2] in ("tracks", "items"):
+        return "spotify playlist read", lambda api, parts, query, body: {
+            "items": [{"track": {"uri": uri, "name": uri, "artists": [{"name": "benchmark"}]}}
+                      for uri in api.playlist_items(parts[1])],
+            "next": None,
+        }
+    if method == "GET" and parts == ["tracks"]:
+        return "spotify tracks", lambda api, parts, query, body: {
+            "tracks": [{"uri": f"spotify:track:{track_id}"} for track_id in query.get("ids", "").split(",") if track_id]
+        }
+    return None
+
+
+def youtube_route(method, parts):
+    if method == "GET" and parts == ["search"]:
+        return "youtube search", lambda api, parts, query, body: {
+            "items": search_results(api, query.get("q", ""), youtube_video)
+        }
+    if method == "POST" and parts == ["playlists"]:
+        return "youtube playlist create", lambda api, parts, query, body: {
+            "id": api.new_playlist(body.get("snippet", {}).get("title", ""))
+        }
+    if method == "GET" and parts == ["playlists"]:
+        return "youtube playlists", lambda api, parts, query, body: {"items": []}
+    if method == "POST" and parts == ["playlistItems"]:
+        return "youtube playlist insert", lambda api, parts, query, body: {
+            "id": str(api.insert_items(
+                body["snippet"]["playlistId"], [body["snippet"]["resourceId"]["videoId"]], body["snippet"].get("position")
+            ))
+        }
+    if method == "GET" and parts == ["playlistItems"]:
+        return "youtube playlist read", lambda api, parts, query, body: {
+            "items": [{"id": f"{query.get('playlistId')}-{position}", "snippet": {
+                "title": video_id, "videoOwnerChannelTitle": "benchmark",
+                "resourceId": {"kind": "youtube#video", "videoId": video_id},
+            }} for position, video_id in enumerate(api.playlist_items(query.get("playlistId")))]
+        }
+    if method == "GET" and parts == ["videos"]:
+        return "youtube videos", lambda api, parts, query, body: {
+            "items": [{"id": video_id} for video_id in query.get("id", "").split(",") if video_id]
+        }
+    return None
+
+
+def start_server(api, host="127.0.0.1", port=0):
+    # Serves on a daemon thread, port 0 picks a free port
+    server = ThreadingHTTPServer((host, port), FakeApiHandler)
+    server.daemon_threads = True
+    server.api = api
+    api.base_url = f"http://{host}:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, name="fake-api", daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the Spotify and YouTube APIs the importers use.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every API request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of API requests answered with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of API requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=0.1, help="Retry-After of a 429 in seconds")
+    args = parser.parse_args(argv)
+
+    api = FakeApi(args.latency, args.error_rate, args.throttle_rate, args.retry_after)
+    server = start_server(api, port=args.port)
+    print(f"Fake Spotify API at {api.base_url}/v1/, fake YouTube API at {api.base_url}/, Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(api.stats())
+
+
+if __name__ == "__main__":
+    main()
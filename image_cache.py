@@ -0,0 +1,128 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from metrics import metrics
+
+IMAGE_CACHE_DIR = os.path.join("cache", "images")
+DISK_CACHE_MAX_BYTES = 200 * 1024 * 1024
+MEMORY_CACHE_MAX_ITEMS = 500
+
+
+def cache_key(url):
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    def __init__(self, directory=IMAGE_CACHE_DIR, max_bytes=DISK_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # key -> size, ordered from least to most recently used
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self.scan()
+
+    def scan(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(".tmp"):
+                # Leftover of an interrupted write
+                os.remove(entry.path)
+                continue
+            stat = entry.stat()
+            files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, key, size in sorted(files):
+            self.entries[key] = size
+            self.total_bytes += size
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, url):
+        key = cache_key(url)
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+        try:
+            with open(self.path(key), "rb") as cache_file:
+                data = cache_file.read()
+            # The mtime keeps the LRU order across runs
+            os.utime(self.path(key))
+            return data
+        except FileNotFoundError:
+            with self.lock:
+                self.total_bytes -= self.entries.pop(key, 0)
+            return None
+
+    def put(self, url, data):
+        key = cache_key(url)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(data)
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self.lock:
+            self.total_bytes += len(data) - self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+            self.evict()
+
+    def evict(self):
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def get_or_fetch(self, url, fetch):
+        data = self.get(url)
+        metrics.count("cache_hits" if data is not None else "cache_misses", "image disk")
+        if data is None:
+            data = fetch(url)
+            self.put(url, data)
+        return data
+
+
+class MemoryCache:
+    # Holds decoded QPixmaps and must therefore only be used from the GUI thread
+    def __init__(self, max_items=MEMORY_CACHE_MAX_ITEMS):
+        self.max_items = max_items
+        self.entries = OrderedDict()
+
+    def get(self, url):
+        pixmap = self.entries.get(url)
+        if pixmap is not None:
+            self.entries.move_to_end(url)
+        return pixmap
+
+    def put(self, url, pixmap):
+        self.entries[url] = pixmap
+        self.entries.move_to_end(url)
+        while len(self.entries) > self.max_items:
+            self.entries.popitem(last=False)
+
+
+disk_cache = None
+disk_cache_lock = threading.Lock()
+memory_cache = MemoryCache()
+
+
+def get_disk_cache():
+    global disk_cache
+    with disk_cache_lock:
+        if disk_cache is None:
+            disk_cache = DiskCache()
+        return disk_cache
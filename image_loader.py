@@ -0,0 +1,98 @@
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from PyQt5.QtCore import QObject, QSize, pyqtSignal
+from PyQt5.QtGui import QColor, QIcon, QImage, QPixmap
+from image_cache import get_disk_cache, memory_cache
+from request_scheduler import get_scheduler, parse_retry_after
+from metrics import metrics
+
+ICON_SIZE = 64
+MAX_IMAGE_WORKERS = 6
+IMAGE_TIMEOUT = 10
+
+# One keep-alive session and one bounded pool shared by every dialog
+session = requests.Session()
+adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=MAX_IMAGE_WORKERS)
+session.mount("https://", adapter)
+session.mount("http://", adapter)
+executor = ThreadPoolExecutor(max_workers=MAX_IMAGE_WORKERS, thread_name_prefix="image")
+
+
+def retry_advice(error):
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        if error.response.status_code == 429:
+            return True, parse_retry_after(error.response.headers.get("Retry-After"))
+        if error.response.status_code >= 500:
+            return False, None
+        return None
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return False, None
+    return None
+
+
+def get_image(url):
+    response = session.get(url, timeout=IMAGE_TIMEOUT)
+    response.raise_for_status()
+    return response.content
+
+
+def fetch_image(url):
+    return get_scheduler("images", retry_advice).call(lambda: get_image(url), endpoint="download")
+
+
+def decode_image(url):
+    # QImage may be used outside the GUI thread, QPixmap may not
+    data = get_disk_cache().get_or_fetch(url, fetch_image)
+    image = QImage()
+    with metrics.timed("image decode"):
+        image.loadFromData(data)
+    return image
+
+
+def prefetch_image(url):
+    # Only warms the disk cache, the pixmap is decoded when a dialog needs it
+    return executor.submit(get_disk_cache().get_or_fetch, url, fetch_image)
+
+
+def placeholder_icon():
+    pixmap = QPixmap(ICON_SIZE, ICON_SIZE)
+    pixmap.fill(QColor("lightgray"))
+    return QIcon(pixmap)
+
+
+class ImageLoader(QObject):
+    image_loaded = pyqtSignal(int, str, QImage)
+
+    def __init__(self, list_widget):
+        super().__init__(list_widget)
+        self.list_widget = list_widget
+        self.list_widget.setIconSize(QSize(ICON_SIZE, ICON_SIZE))
+        self.image_loaded.connect(self.set_icon)
+
+    def load(self, row, url):
+        pixmap = memory_cache.get(url)
+        metrics.count("cache_hits" if pixmap is not None else "cache_misses", "image memory")
+        if pixmap is not None:
+            self.list_widget.item(row).setIcon(QIcon(pixmap))
+            return
+        self.list_widget.item(row).setIcon(placeholder_icon())
+        future = executor.submit(decode_image, url)
+        future.add_done_callback(lambda done: self.on_done(row, url, done))
+
+    def on_done(self, row, url, future):
+        if future.exception() is not None:
+            return
+        try:
+            self.image_loaded.emit(row, url, future.result())
+        except RuntimeError:
+            # The dialog was closed before the download finished
+            pass
+
+    def set_icon(self, row, url, image):
+        if image.isNull():
+            return
+        pixmap = QPixmap.fromImage(image)
+        memory_cache.put(url, pixmap)
+        item = self.list_widget.item(row)
+        if item is not None:
+            item.setIcon(QIcon(pixmap))
@@ -1,13 +1,17 @@
+import time
+# Measured before PyQt5 is imported, the launcher should be up in well under a second
+started_at = time.perf_counter()
+
 import sys
-import subprocess
+import importlib
 from PyQt5.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QPushButton, QMessageBox, QWidget
-import os
 
 class ImportWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Import auswählen")
         self.setGeometry(100, 100, 400, 200)
+        self.windows = {}
 
         central_widget = QWidget(self)
         self.setCentralWidget(central_widget)
@@ -25,22 +29,31 @@ class ImportWindow(QMainWindow):
         central_widget.setLayout(layout)
 
     def import_spotify(self):
-        try:
-            script_path = os.path.join(os.path.dirname(__file__), 'spotify.py')
-            subprocess.run([sys.executable, script_path], check=True)
-        except subprocess.CalledProcessError as e:
-            QMessageBox.critical(self, "Fehler", f"Error while starting spotify: {e}")
+        self.open_importer("spotify")
 
     def import_youtube(self):
-        try:
-            script_path = os.path.join(os.path.dirname(__file__), 'youtube.py')
-            subprocess.run([sys.executable, script_path], check=True)
-        except subprocess.CalledProcessError as e:
-            QMessageBox.critical(self, "Fehler", f"Error while starting youtube: {e}")
+        self.open_importer("youtube")
+
+    def open_importer(self, name):
+        # The importers run in this process, their module and provider SDK are imported on first use
+        window = self.windows.get(name)
+        if window is None:
+            opened_at = time.perf_counter()
+            try:
+                window = importlib.import_module(name).MainWindow()
+            except Exception as e:
+                QMessageBox.critical(self, "Fehler", f"Error while starting {name}: {e}")
+                return
+            self.windows[name] = window
+            print(f"{name} importer opened in {time.perf_counter() - opened_at:.2f}s")
+        window.show()
+        window.raise_()
+        window.activateWindow()
 
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     window = ImportWindow()
     window.show()
+    print(f"Launcher started in {time.perf_counter() - started_at:.2f}s")
     sys.exit(app.exec_())
@@ -0,0 +1,78 @@
+from PyQt5.QtCore import QThread
+from PyQt5.QtWidgets import QHBoxLayout, QLabel, QProgressBar, QPushButton, QWidget
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+class ImportProgress(QWidget):
+    # Progress bar and Cancel button of an ImportWorker, which runs on a QThread owned by this widget
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.thread = None
+        self.worker = None
+
+        layout = QHBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.progress_bar = QProgressBar(self)
+        layout.addWidget(self.progress_bar)
+        self.progress_label = QLabel(self)
+        layout.addWidget(self.progress_label)
+        self.cancel_button = QPushButton("Cancel", self)
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancel)
+        layout.addWidget(self.cancel_button)
+
+    def start(self, worker, answer_input, import_finished):
+        self.worker = worker
+        self.thread = QThread(self)
+        worker.moveToThread(self.thread)
+        self.thread.started.connect(worker.run)
+        worker.progress.connect(self.show_progress)
+        worker.input_needed.connect(answer_input)
+        worker.import_done.connect(self.finish)
+        worker.import_done.connect(import_finished)
+        self.progress_bar.setRange(0, 0)
+        self.progress_label.setText("Starting import...")
+        self.cancel_button.setEnabled(True)
+        self.thread.start()
+
+    def is_running(self):
+        return self.thread is not None
+
+    def show_progress(self, done, total, rate, eta):
+        self.progress_bar.setRange(0, max(total, 1))
+        self.progress_bar.setValue(done)
+        text = f"{done} of {total} songs, {rate:.1f} songs/s"
+        if eta >= 0:
+            text += f", {format_duration(eta)} left"
+        self.progress_label.setText(text)
+
+    def cancel(self):
+        if self.worker is not None:
+            self.cancel_button.setEnabled(False)
+            self.progress_label.setText("Cancelling, writing the songs chosen so far...")
+            self.worker.cancel()
+
+    def finish(self, outcome):
+        self.thread.quit()
+        self.thread.wait()
+        self.thread.deleteLater()
+        self.thread = None
+        self.worker = None
+        self.cancel_button.setEnabled(False)
+        if self.progress_bar.maximum() == 0:
+            self.progress_bar.setRange(0, 1)
+        self.progress_label.setText(f"Import {outcome.result}")
+
+    def wait(self):
+        # Used when the window closes during an import, the worker still writes what was chosen
+        if self.thread is not None:
+            self.worker.cancel()
+            self.thread.quit()
+            self.thread.wait()
@@ -0,0 +1,322 @@
+import threading
+import time
+from collections import namedtuple
+from PyQt5.QtCore import QObject, pyqtSignal
+from dedupe import DuplicateFilter, NEW, IN_PLAYLIST
+from journal import ImportJournal, DECISION_CHOSEN, DECISION_SKIPPED
+from matching import rank_candidates
+from metrics import metrics, recorded_run
+from playlist_sync import SyncMap
+from playlist_buffer import PlaylistAddBuffer, FLUSH_INTERVAL_MS
+from prefetch import SearchPrefetcher, LOOKAHEAD_DEPTH
+from request_scheduler import scheduler_stats
+from search_cache import get_search_cache
+from sheet_reader import SongRow, row_duration
+from song_model import MATCHED, SKIPPED, ADDED, DUPLICATE, PRESENT
+from youtube_quota import QuotaBudgetExceeded, plan_quota, describe_plan, SEARCH_COST
+
+PROGRESS_INTERVAL = 0.25
+RESUME_HINT = "Import this file again to continue where the import stopped."
+
+# What the worker waits for, answered through ImportWorker.reply
+ASK_QUESTION = "question"
+ASK_CHOICE = "choice"
+
+CHOOSE, SKIP, SEARCH, STOP = "choose", "skip", "search", "stop"
+
+FINISHED, CANCELLED, STOPPED, FAILED = "finished", "cancelled", "stopped", "failed"
+
+ChoiceRequest = namedtuple("ChoiceRequest", ["row", "artist", "title", "query", "items", "scores"])
+Choice = namedtuple("Choice", ["action", "item_id", "query", "force_refresh"], defaults=[None, None, False])
+ImportOutcome = namedtuple("ImportOutcome", ["result", "message", "skipped_songs", "stats"])
+
+
+class ImportCancelled(Exception):
+    pass
+
+
+class ImportWorker(QObject):
+    # Runs a whole import on its own thread, the window only sees these signals
+    input_needed = pyqtSignal(str, object)
+    progress = pyqtSignal(int, int, float, float)
+    status_changed = pyqtSignal(int, int)
+    import_done = pyqtSignal(object)
+
+    def __init__(self, create_provider, model, sheet_path, playlist_name, description="",
+                 target_playlist_id=None, state=None, lookahead=LOOKAHEAD_DEPTH, quota_plan=False, sync_keys=None):
+        super().__init__()
+        self.create_provider = create_provider
+        # Copies, the model stays with the GUI thread
+        self.artists = list(model.artists)
+        self.titles = list(model.titles)
+        self.extras = list(model.extras)
+        self.sheet_path = sheet_path
+        self.playlist_name = playlist_name
+        self.description = description
+        self.target_playlist_id = target_playlist_id
+        self.state = state
+        self.lookahead = lookahead
+        self.quota_plan = quota_plan
+        # Row keys of songs loaded from the review file of a sync, None for other rows
+        self.sync_keys = sync_keys
+        self.chosen_items = {}
+        self.skipped_songs = []
+        self.started = False
+        self.cancelled = False
+        self.reply_event = threading.Event()
+        self.reply_value = None
+        self.done_rows = 0
+        self.started_rows = 0
+        self.started_at = 0.0
+        self.progress_at = 0.0
+
+    def cancel(self):
+        self.cancelled = True
+        self.reply_event.set()
+
+    def reply(self, value):
+        self.reply_value = value
+        self.reply_event.set()
+
+    def ask(self, kind, payload, add_buffer=None):
+        self.reply_event.clear()
+        # Checked after clearing, a cancel that came during a search would otherwise leave the dialog unanswered
+        self.check_cancelled()
+        self.reply_value = None
+        self.input_needed.emit(kind, payload)
+        with metrics.timed(f"operator {kind}"):
+            while not self.reply_event.wait(FLUSH_INTERVAL_MS / 1000) and not self.cancelled:
+                # Songs chosen so far reach the playlist while the user is still deciding
+                if add_buffer is not None:
+                    add_buffer.flush()
+        self.check_cancelled()
+        return self.reply_value
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise ImportCancelled()
+
+    def run(self):
+        provider = None
+        details = {"sheet": self.sheet_path, "playlist": self.playlist_name, "rows": len(self.artists)}
+        with recorded_run(details):
+            try:
+                provider = self.create_provider()
+                details["provider"] = provider.name
+                self.import_songs(provider)
+                outcome = FINISHED, ""
+            except ImportCancelled:
+                outcome = CANCELLED, RESUME_HINT if self.started else ""
+            except QuotaBudgetExceeded as e:
+                outcome = STOPPED, f"{e}\n{RESUME_HINT}"
+            except (Exception, SystemExit) as e:
+                # SystemExit comes from a missing or broken config file
+                outcome = FAILED, str(e)
+            details.update(result=outcome[0], done_rows=self.done_rows, skipped=len(self.skipped_songs))
+        self.import_done.emit(ImportOutcome(*outcome, self.skipped_songs, self.stats(provider)))
+
+    def stats(self, provider):
+        search_cache = get_search_cache()
+        lines = [search_cache.stats()] + scheduler_stats()
+        if self.quota_plan and provider is not None:
+            lines.append(f"{provider.quota.stats()}, {search_cache.hits * SEARCH_COST} units saved by the search cache")
+        return lines
+
+    def set_status(self, row, status):
+        self.status_changed.emit(row, status)
+
+    def report_progress(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.progress_at < PROGRESS_INTERVAL:
+            return
+        self.progress_at = now
+        rate = (self.done_rows - self.started_rows) / max(now - self.started_at, 1e-3)
+        remaining = len(self.artists) - self.done_rows
+        eta = remaining / rate if rate > 0 else -1.0
+        self.progress.emit(self.done_rows, len(self.artists), rate, eta)
+
+    def import_songs(self, provider):
+        state = self.state
+        if self.quota_plan:
+            songs = (self.song(index) for index in range(len(self.artists)))
+            plan = plan_quota(provider, songs, state is None and not self.target_playlist_id)
+            if not self.ask(ASK_QUESTION, f"{describe_plan(plan, provider.quota)}\n\nDo you want to start the import?"):
+                raise ImportCancelled()
+
+        duplicate_filter = DuplicateFilter()
+        if state is not None:
+            playlist_id = state.playlist_id
+        else:
+            playlist_id = self.target_playlist_id or self.find_existing_playlist(provider)
+        if playlist_id:
+            duplicate_filter.load_playlist(provider, playlist_id)
+        else:
+            playlist_id = provider.create_playlist(self.playlist_name, self.description)
+        journal = ImportJournal(provider.name, self.sheet_path, resume=state is not None)
+        if state is None:
+            journal.start(playlist_id, self.playlist_name)
+        self.started = True
+
+        def rows_written(rows):
+            journal.record_written(rows)
+            for row in rows:
+                self.set_status(row, ADDED)
+
+        add_buffer = PlaylistAddBuffer(
+            lambda item_ids: provider.add_items(playlist_id, item_ids), provider.write_chunk_size,
+            on_written=rows_written
+        )
+        try:
+            self.process_rows(provider, journal, add_buffer, duplicate_filter)
+            add_buffer.flush()
+            journal.finish()
+        finally:
+            # Cancelled or failed, everything chosen so far is still written
+            try:
+                add_buffer.flush()
+            finally:
+                journal.close()
+                self.record_sync_choices(provider, playlist_id)
+        self.done_rows = len(self.artists)
+        self.report_progress(force=True)
+
+    def record_sync_choices(self, provider, playlist_id):
+        # Otherwise the next sync would search these rows again and take the chosen songs out of the playlist
+        if self.sync_keys is None:
+            return
+        choices = {
+            tuple(self.sync_keys[index]): item_id for index, item_id in self.chosen_items.items()
+            if self.sync_keys[index] is not None
+        }
+        if choices:
+            SyncMap(provider.name, playlist_id).record(choices)
+
+    def find_existing_playlist(self, provider):
+        playlist_id = provider.find_playlist(self.playlist_name)
+        if playlist_id is None:
+            return None
+        add_to_existing = self.ask(
+            ASK_QUESTION,
+            f"A playlist named '{self.playlist_name}' already exists. Do you want to add the songs to it?"
+        )
+        return playlist_id if add_to_existing else None
+
+    def song(self, index):
+        return SongRow(self.artists[index], self.titles[index], self.extras[index])
+
+    def restore_journal_state(self, add_buffer, duplicate_filter):
+        state = self.state
+        for row, (decision, item_id) in state.decisions.items():
+            self.set_status(row, SKIPPED if decision == DECISION_SKIPPED else MATCHED)
+            if decision == DECISION_CHOSEN:
+                self.chosen_items[row] = item_id
+        for row in state.written:
+            self.set_status(row, ADDED)
+        # Chosen before the stop but never written to the playlist
+        for row, item_id in state.unwritten_choices():
+            if duplicate_filter.claim_item(item_id):
+                add_buffer.add(item_id, row)
+            else:
+                self.set_status(row, ADDED)
+
+    def rows_to_search(self, duplicate_filter):
+        # Repeated songs and songs already in the playlist are not searched at all
+        rows = []
+        for index in range(len(self.artists)):
+            match = duplicate_filter.classify(self.artists[index], self.titles[index])
+            if self.state is not None and self.state.is_decided(index):
+                continue
+            if match == NEW:
+                rows.append(index)
+            else:
+                self.set_status(index, PRESENT if match == IN_PLAYLIST else DUPLICATE)
+        return rows
+
+    def resolve_direct_items(self, provider, rows):
+        # Rows that name their track or video are verified in bulk instead of searched, unknown ones are searched.
+        # Returns row -> item, the items are added when the import reaches their row so the sheet order is kept.
+        direct_rows = [(index, provider.direct_item_id(self.song(index))) for index in rows]
+        direct_rows = [(index, direct_id) for index, direct_id in direct_rows if direct_id is not None]
+        if not direct_rows:
+            return {}
+        resolved = provider.resolve_items([direct_id for _, direct_id in direct_rows])
+        return {index: resolved[direct_id] for index, direct_id in direct_rows if direct_id in resolved}
+
+    def add_direct_items(self, journal, add_buffer, duplicate_filter, direct_items, before_row):
+        # Pops the resolved rows up to before_row off direct_items, a list of (row, item) in sheet order
+        while direct_items and direct_items[-1][0] < before_row:
+            index, item_id = direct_items.pop()
+            journal.record(index, DECISION_CHOSEN, item_id)
+            self.choose(add_buffer, duplicate_filter, index, item_id)
+
+    def choose(self, add_buffer, duplicate_filter, index, item_id):
+        self.chosen_items[index] = item_id
+        if duplicate_filter.claim_item(item_id):
+            self.set_status(index, MATCHED)
+            add_buffer.add(item_id, index)
+        else:
+            self.set_status(index, DUPLICATE)
+
+    def skip_song(self, journal, index, query):
+        self.skipped_songs.append(query)
+        self.set_status(index, SKIPPED)
+        journal.record(index, DECISION_SKIPPED)
+
+    def process_rows(self, provider, journal, add_buffer, duplicate_filter):
+        if self.state is not None:
+            self.restore_journal_state(add_buffer, duplicate_filter)
+        rows = self.rows_to_search(duplicate_filter)
+        resolved = self.resolve_direct_items(provider, rows)
+        rows = [index for index in rows if index not in resolved]
+        # Reversed, so the next row to add is at the end
+        direct_items = sorted(resolved.items(), reverse=True)
+        edited_queries = self.state.queries if self.state is not None else {}
+        queries = [edited_queries.get(index, f"{self.artists[index]} {self.titles[index]}") for index in rows]
+
+        self.done_rows = self.started_rows = len(self.artists) - len(rows)
+        self.started_at = time.monotonic()
+        self.report_progress(force=True)
+
+        prefetcher = SearchPrefetcher(provider.search, provider.image_urls, self.lookahead)
+        try:
+            for position, index in enumerate(rows):
+                self.check_cancelled()
+                self.add_direct_items(journal, add_buffer, duplicate_filter, direct_items, index)
+                artist, title = self.artists[index], self.titles[index]
+                prefetcher.advance(position, queries)
+                query = queries[position]
+                force_refresh = False
+
+                while True:
+                    provider.refresh_credentials()
+                    with metrics.timed("search wait"):
+                        search_results = prefetcher.get(position, query, force_refresh)
+                    items = provider.search_items(search_results)
+                    if not items:
+                        self.skip_song(journal, index, query)
+                        break
+
+                    with metrics.timed("scoring"):
+                        scores = rank_candidates(
+                            provider, [(artist, title)], [items], [row_duration(self.song(index))]
+                        )[0]
+                    choice = self.ask(ASK_CHOICE, ChoiceRequest(index, artist, title, query, items, scores), add_buffer)
+                    if choice.action == CHOOSE:
+                        journal.record(index, DECISION_CHOSEN, choice.item_id)
+                        self.choose(add_buffer, duplicate_filter, index, choice.item_id)
+                        break
+                    if choice.action == SEARCH:
+                        query = choice.query
+                        force_refresh = choice.force_refresh
+                        journal.record_query(index, query)
+                        continue
+                    if choice.action == STOP:
+                        raise ImportCancelled()
+                    self.skip_song(journal, index, query)
+                    break
+
+                self.done_rows += 1
+                self.report_progress()
+            self.add_direct_items(journal, add_buffer, duplicate_filter, direct_items, len(self.artists))
+        finally:
+            prefetcher.close()
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+
+JOURNAL_DIR = "journals"
+SYNC_INTERVAL = 25
+
+DECISION_CHOSEN = "chosen"
+DECISION_SKIPPED = "skipped"
+DECISION_REVIEW = "review"
+QUERY = "query"
+
+
+def journal_path(provider_name, file_name):
+    # A changed sheet gets a new journal, row numbers of the old one would not fit anymore
+    stat = os.stat(file_name)
+    sheet = f"{provider_name}|{os.path.abspath(file_name)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return os.path.join(JOURNAL_DIR, f"{provider_name}-{hashlib.sha1(sheet.encode('utf-8')).hexdigest()[:16]}.jsonl")
+
+
+class JournalState:
+    def __init__(self):
+        self.playlist_id = None
+        self.playlist_name = None
+        self.decisions = {}
+        self.queries = {}
+        self.written = set()
+        self.finished = False
+
+    def apply(self, record):
+        kind = record["type"]
+        if kind == "start":
+            self.playlist_id = record["playlist_id"]
+            self.playlist_name = record["playlist_name"]
+        elif kind == "decision":
+            self.decisions[record["row"]] = (record["decision"], record.get("item_id"))
+        elif kind == QUERY:
+            self.queries[record["row"]] = record["query"]
+        elif kind == "written":
+            self.written.update(record["rows"])
+        elif kind == "finished":
+            self.finished = True
+
+    def is_decided(self, row):
+        return row in self.decisions
+
+    def unwritten_choices(self):
+        return [
+            (row, item_id) for row, (decision, item_id) in sorted(self.decisions.items())
+            if decision == DECISION_CHOSEN and row not in self.written
+        ]
+
+
+def load_journal(path):
+    state = JournalState()
+    with open(path, "r", encoding="utf-8") as journal_file:
+        for line in journal_file:
+            try:
+                state.apply(json.loads(line))
+            except json.JSONDecodeError:
+                # The last line of a crashed run may be cut off
+                break
+    return state
+
+
+def find_unfinished_journal(provider_name, file_name):
+    path = journal_path(provider_name, file_name)
+    if not os.path.exists(path):
+        return None
+    state = load_journal(path)
+    if state.finished or state.playlist_id is None:
+        return None
+    return state
+
+
+class ImportJournal:
+    def __init__(self, provider_name, file_name, resume=False):
+        os.makedirs(JOURNAL_DIR, exist_ok=True)
+        self.file = open(journal_path(provider_name, file_name), "a" if resume else "w", encoding="utf-8")
+        self.unsynced = 0
+
+    def write(self, record, sync=False):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.unsynced += 1
+        if sync or self.unsynced >= SYNC_INTERVAL:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def start(self, playlist_id, playlist_name):
+        self.write({"type": "start", "playlist_id": playlist_id, "playlist_name": playlist_name}, sync=True)
+
+    def record(self, row, decision, item_id=None):
+        self.write({"type": "decision", "row": row, "decision": decision, "item_id": item_id})
+
+    def record_query(self, row, query):
+        self.write({"type": QUERY, "row": row, "query": query})
+
+    def record_written(self, rows):
+        # Synced right away, a lost "written" record would add the items a second time
+        self.write({"type": "written", "rows": list(rows)}, sync=True)
+
+    def finish(self):
+        self.write({"type": "finished"}, sync=True)
+        self.close()
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
@@ -0,0 +1,184 @@
+import re
+import unicodedata
+from functools import lru_cache
+import numpy as np
+
+AUTO_ACCEPT_THRESHOLD = 0.85
+
+SIGNATURE_BITS = 512
+MAX_MATCH_LENGTH = 64
+TITLE_WEIGHT = 0.55
+ARTIST_WEIGHT = 0.35
+DURATION_WEIGHT = 0.10
+DURATION_TOLERANCE = 30
+VERSION_PENALTY = 0.2
+
+# A different recording than the one in the sheet, only acceptable when asked for
+VERSION_MARKERS = (
+    "live", "remix", "acoustic", "karaoke", "instrumental", "cover", "demo",
+    "sped up", "slowed", "nightcore", "unplugged", "rehearsal",
+)
+# Same recording under another label, removed before comparing
+NEUTRAL_MARKERS = (
+    "remastered", "remaster", "radio edit", "single version", "album version", "mono", "stereo",
+    "official music video", "official video", "official audio", "lyric video", "lyrics", "audio", "hd", "hq",
+)
+
+# "with" names another artist only in an artist or a bracket group, "Stay With Me" keeps it
+TITLE_FEATURING = re.compile(r"\s(?:feat|ft|featuring)\b.*$")
+ARTIST_FEATURING = re.compile(r"\s(?:feat|ft|featuring|with)\b.*$")
+FEATURING_GROUP = re.compile(r"^\W*(?:feat|ft|featuring|with)\b")
+BRACKETS = re.compile(r"[\(\[\{]([^\)\]\}]*)[\)\]\}]")
+DASH_SUFFIX = re.compile(r"\s-\s(.*)$")
+PART = re.compile(r"\bpt\b\.?")
+NUMBER = re.compile(r"\d+")
+NEUTRAL = re.compile(r"\b(?:" + "|".join(NEUTRAL_MARKERS) + r")\b")
+# A year is a label only next to one, like "(2011 Remaster)", "1999" or "2002" are titles
+YEAR = re.compile(r"\b(?:19|20)\d{2}\b")
+NON_WORD = re.compile(r"[^\w\s]")
+VERSION = re.compile(r"\b(?:" + "|".join(VERSION_MARKERS) + r")\b")
+VERSION_BITS = {marker: 1 << bit for bit, marker in enumerate(VERSION_MARKERS)}
+ARTIST_NOISE = re.compile(r"\b(?:vevo|official|topic)\b")
+
+
+def fold(text):
+    text = str(text)
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(char for char in text if not unicodedata.combining(char))
+    return text.casefold()
+
+
+def clean(text):
+    text = NON_WORD.sub(" ", text)
+    text = NEUTRAL.sub(" ", text)
+    return " ".join(text.split())
+
+
+@lru_cache(maxsize=200000)
+def version_mask(text):
+    mask = 0
+    for marker in VERSION.findall(NON_WORD.sub(" ", fold(text))):
+        mask |= VERSION_BITS[marker]
+    return mask
+
+
+def only_label(text):
+    # Featured artists, a neutral label or a version marker, nothing that tells two songs apart like "Part 2"
+    if FEATURING_GROUP.match(text):
+        return True
+    return not VERSION.sub(" ", NEUTRAL.sub(" ", YEAR.sub(" ", NON_WORD.sub(" ", text)))).strip()
+
+
+def strip_labels(text):
+    text = BRACKETS.sub(lambda match: " " if only_label(match.group(1)) else match.group(), text)
+    return DASH_SUFFIX.sub(lambda match: " " if only_label(match.group(1)) else match.group(), text)
+
+
+@lru_cache(maxsize=200000)
+def normalize_title(title):
+    text = fold(title)
+    text = strip_labels(text)
+    text = TITLE_FEATURING.sub(" ", text)
+    text = PART.sub("part", text)
+    text = VERSION.sub(" ", text)
+    return clean(text)
+
+
+@lru_cache(maxsize=200000)
+def normalize_artist(artist):
+    text = fold(artist)
+    text = BRACKETS.sub(" ", text)
+    text = ARTIST_FEATURING.sub(" ", text)
+    text = ARTIST_NOISE.sub(" ", text)
+    return clean(text)
+
+
+@lru_cache(maxsize=200000)
+def title_numbers(title):
+    # Part and volume numbers, titles that differ in them are different songs
+    return frozenset(NUMBER.findall(normalize_title(title)))
+
+
+def signatures(texts):
+    # Hashed character trigrams of every text as a bitset, computed for all texts at once
+    padded = [f" {text[:MAX_MATCH_LENGTH - 2]} " for text in texts]
+    width = max((len(text) for text in padded), default=3)
+    codes = np.array(padded, dtype=f"<U{width}").view(np.uint32).reshape(len(padded), width).astype(np.uint64)
+    valid = codes != 0
+    hashes = ((codes[:, :-2] * 961 + codes[:, 1:-1] * 31 + codes[:, 2:]) * 2654435761 >> 20) % SIGNATURE_BITS
+    in_text = valid[:, :-2] & valid[:, 1:-1] & valid[:, 2:]
+    bits = np.zeros((len(padded), SIGNATURE_BITS), dtype=bool)
+    rows = np.broadcast_to(np.arange(len(padded))[:, None], hashes.shape)
+    bits[rows[in_text], hashes[in_text].astype(np.intp)] = True
+    return np.packbits(bits, axis=1)
+
+
+def popcount(bitsets):
+    return np.bitwise_count(bitsets).sum(axis=1, dtype=np.int32)
+
+
+def dice(left, right):
+    total = popcount(left) + popcount(right)
+    return np.where(total > 0, 2 * popcount(left & right) / np.maximum(total, 1), 0.0)
+
+
+def containment(part, whole):
+    size = popcount(part)
+    return np.where(size > 0, popcount(part & whole) / np.maximum(size, 1), 0.0)
+
+
+def score_candidates(songs, candidates):
+    # songs: (artist, title, seconds or None) per row
+    # candidates: (row, artist, title, seconds or None), all scored in one vectorized pass
+    if not candidates:
+        return np.zeros(0)
+    rows = np.fromiter((candidate[0] for candidate in candidates), dtype=np.intp, count=len(candidates))
+
+    song_titles = signatures([normalize_title(title) for _, title, _ in songs])[rows]
+    song_artists = signatures([normalize_artist(artist) for artist, _, _ in songs])[rows]
+    candidate_titles = signatures([normalize_title(candidate[2]) for candidate in candidates])
+    candidate_artists = signatures([normalize_artist(candidate[1]) for candidate in candidates])
+
+    title_score = dice(song_titles, candidate_titles)
+    artist_score = containment(song_artists, candidate_artists)
+
+    song_durations = np.array([np.nan if duration is None else duration for _, _, duration in songs], dtype=float)[rows]
+    candidate_durations = np.array([np.nan if candidate[3] is None else candidate[3] for candidate in candidates], dtype=float)
+    difference = np.abs(song_durations - candidate_durations)
+    has_duration = ~np.isnan(difference)
+    duration_score = np.clip(1 - np.nan_to_num(difference) / DURATION_TOLERANCE, 0, 1)
+
+    weighted = TITLE_WEIGHT * title_score + ARTIST_WEIGHT * artist_score
+    score = np.where(
+        has_duration,
+        weighted + DURATION_WEIGHT * duration_score,
+        weighted / (TITLE_WEIGHT + ARTIST_WEIGHT)
+    )
+
+    song_masks = np.array([version_mask(title) for _, title, _ in songs], dtype=np.uint32)[rows]
+    candidate_masks = np.array([version_mask(candidate[2]) for candidate in candidates], dtype=np.uint32)
+    mismatches = np.bitwise_count(song_masks ^ candidate_masks).astype(np.int32)
+    song_numbers = [title_numbers(title) for _, title, _ in songs]
+    mismatches += np.fromiter(
+        (song_numbers[candidate[0]] != title_numbers(candidate[2]) for candidate in candidates), dtype=np.int32, count=len(candidates)
+    )
+    return np.clip(score - VERSION_PENALTY * mismatches, 0, 1)
+
+
+def rank_candidates(provider, songs, items_per_song, durations=None):
+    candidates = [
+        (row, *provider.item_match_fields(item))
+        for row, items in enumerate(items_per_song)
+        for item in items
+    ]
+    durations = durations or [None] * len(songs)
+    scores = score_candidates(
+        [(artist, title, duration) for (artist, title), duration in zip(songs, durations)], candidates
+    )
+    ranked = []
+    start = 0
+    for items in items_per_song:
+        ranked.append(scores[start:start + len(items)])
+        start += len(items)
+    return ranked
@@ -0,0 +1,297 @@
+import cProfile
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+
+# The GUI importers are switched on through these, batch_import.py also has options for them
+REPORT_VARIABLE = "IMPORT_METRICS_FILE"
+PROMETHEUS_VARIABLE = "IMPORT_METRICS_PROMETHEUS_FILE"
+PROFILE_VARIABLE = "IMPORT_PROFILE_FILE"
+# Upper bounds in seconds, from a cache hit up to the operator thinking over a choice
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+PROMETHEUS_PREFIX = "playlist_import"
+# Label name of every counter in the Prometheus file
+COUNTER_LABELS = {
+    "requests": "endpoint",
+    "retries": "endpoint",
+    "quota_units": "endpoint",
+    "cache_hits": "cache",
+    "cache_misses": "cache",
+}
+NOT_TIMED = nullcontext()
+
+
+class Histogram:
+    def __init__(self):
+        # One more bucket than bounds, for everything above the last one
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.longest = 0.0
+
+    def copy(self):
+        histogram = Histogram()
+        histogram.counts = list(self.counts)
+        histogram.count = self.count
+        histogram.total = self.total
+        histogram.longest = self.longest
+        return histogram
+
+    def since(self, earlier):
+        # What was observed after earlier was copied. The longest of those is not known exactly,
+        # it is at most the longest overall and the bound of the highest bucket that grew.
+        histogram = Histogram()
+        histogram.counts = [count - before for count, before in zip(self.counts, earlier.counts)]
+        histogram.count = self.count - earlier.count
+        histogram.total = self.total - earlier.total
+        grown = [index for index, count in enumerate(histogram.counts) if count]
+        if grown and grown[-1] < len(LATENCY_BUCKETS):
+            histogram.longest = min(self.longest, LATENCY_BUCKETS[grown[-1]])
+        elif grown:
+            histogram.longest = self.longest
+        return histogram
+
+    def observe(self, seconds):
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.longest = max(self.longest, seconds)
+
+    def quantile(self, share):
+        # Upper bound of the bucket the quantile falls into
+        rank = share * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.longest)
+        return self.longest
+
+    def cumulative(self):
+        counts = []
+        seen = 0
+        for count in self.counts:
+            seen += count
+            counts.append(seen)
+        return counts
+
+    def report(self):
+        return {
+            "count": self.count,
+            "seconds": round(self.total, 6),
+            "average": round(self.total / self.count, 6) if self.count else 0.0,
+            "p50": round(self.quantile(0.5), 6),
+            "p95": round(self.quantile(0.95), 6),
+            "longest": round(self.longest, 6),
+            "buckets": dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"], self.cumulative())),
+        }
+
+
+class PhaseTimer:
+    # A plain class, a generator based context manager costs several times as much per use
+    def __init__(self, metrics, phase):
+        self.metrics = metrics
+        self.phase = phase
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.phase, time.perf_counter() - self.started)
+
+
+class RunSnapshot:
+    # The totals when a run started, its report is the difference
+    def __init__(self, started_at, histograms, counters, overlapped):
+        self.started_at = started_at
+        self.histograms = histograms
+        self.counters = counters
+        # Another run was active at the same time, its requests and cache lookups are in this report too
+        self.overlapped = overlapped
+
+
+def label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class Metrics:
+    # Disabled unless a report is asked for, then every hook costs no more than a look at self.enabled.
+    # The totals are never reset during a run, imports running side by side each report from a snapshot.
+    def __init__(self, report_path=None, prometheus_path=None):
+        self.lock = threading.Lock()
+        self.active_runs = []
+        self.configure(report_path, prometheus_path)
+
+    def configure(self, report_path, prometheus_path=None):
+        self.report_path = report_path
+        self.prometheus_path = prometheus_path
+        self.enabled = bool(report_path or prometheus_path)
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.histograms = {}
+            self.counters = {}
+
+    def observe(self, phase, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get(phase)
+            if histogram is None:
+                histogram = self.histograms[phase] = Histogram()
+            histogram.observe(seconds)
+
+    def timed(self, phase):
+        if not self.enabled:
+            return NOT_TIMED
+        return PhaseTimer(self, phase)
+
+    def timed_iter(self, phase, iterable):
+        # The time spent producing the elements, observed once when the iteration ends
+        if not self.enabled:
+            return iterable
+        return self.iterate_timed(phase, iter(iterable))
+
+    def iterate_timed(self, phase, iterator):
+        spent = 0.0
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    element = next(iterator)
+                except StopIteration:
+                    spent += time.perf_counter() - started
+                    return
+                spent += time.perf_counter() - started
+                yield element
+        finally:
+            self.observe(phase, spent)
+
+    def start_run(self):
+        with self.lock:
+            run = RunSnapshot(
+                time.time(), {phase: histogram.copy() for phase, histogram in self.histograms.items()},
+                {name: Counter(counter) for name, counter in self.counters.items()}, bool(self.active_runs)
+            )
+            for other in self.active_runs:
+                other.overlapped = True
+            self.active_runs.append(run)
+        return run
+
+    def finish_run(self, run):
+        with self.lock:
+            self.active_runs.remove(run)
+
+    def count(self, name, label, amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            counter = self.counters.get(name)
+            if counter is None:
+                counter = self.counters[name] = Counter()
+            counter[label] += amount
+
+    def report(self, details=None, run=None):
+        # Everything since the start, or since run started
+        with self.lock:
+            if run is None:
+                started_at = self.started_at
+                histograms = self.histograms
+                counters = self.counters
+            else:
+                started_at = run.started_at
+                histograms = {
+                    phase: histogram.since(run.histograms[phase]) if phase in run.histograms else histogram
+                    for phase, histogram in self.histograms.items()
+                }
+                histograms = {phase: histogram for phase, histogram in histograms.items() if histogram.count}
+                counters = {name: counter - run.counters.get(name, Counter()) for name, counter in self.counters.items()}
+                counters = {name: counter for name, counter in counters.items() if counter}
+            hits = counters.get("cache_hits", Counter())
+            misses = counters.get("cache_misses", Counter())
+            report = {
+                "started": datetime.fromtimestamp(started_at, timezone.utc).isoformat(timespec="seconds"),
+                "seconds": round(time.time() - started_at, 3),
+                "run": details or {},
+                "phases": {phase: histogram.report() for phase, histogram in sorted(histograms.items())},
+                "counters": {name: dict(sorted(counter.items())) for name, counter in sorted(counters.items())},
+                "cache_hit_ratios": {
+                    cache: round(hits[cache] / (hits[cache] + misses[cache]), 4) for cache in sorted(set(hits) | set(misses))
+                },
+            }
+            if run is not None:
+                report["overlapped_other_runs"] = run.overlapped
+            return report
+
+    def prometheus_text(self):
+        lines = []
+        with self.lock:
+            name = f"{PROMETHEUS_PREFIX}_phase_seconds"
+            lines += [f"# HELP {name} Time spent per phase of the import.", f"# TYPE {name} histogram"]
+            for phase, histogram in sorted(self.histograms.items()):
+                phase = label_value(phase)
+                bounds = [str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"]
+                for bound, count in zip(bounds, histogram.cumulative()):
+                    lines.append(f"{name}_bucket{{phase=\"{phase}\",le=\"{bound}\"}} {count}")
+                lines.append(f"{name}_sum{{phase=\"{phase}\"}} {histogram.total}")
+                lines.append(f"{name}_count{{phase=\"{phase}\"}} {histogram.count}")
+            for counter_name, counter in sorted(self.counters.items()):
+                name = f"{PROMETHEUS_PREFIX}_{counter_name}_total"
+                label = COUNTER_LABELS.get(counter_name, "label")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in sorted(counter.items()):
+                    lines.append(f"{name}{{{label}=\"{label_value(key)}\"}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, details=None, run=None):
+        # The JSON report covers run, the Prometheus counters are the totals of the process as Prometheus expects
+        if not self.enabled:
+            return
+        if self.report_path:
+            write_file(self.report_path, json.dumps(self.report(details, run), indent=2))
+        if self.prometheus_path:
+            write_file(self.prometheus_path, self.prometheus_text())
+
+
+def make_parent(path):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+
+def write_file(path, text):
+    make_parent(path)
+    with open(path, "w", encoding="utf-8") as report_file:
+        report_file.write(text)
+
+
+metrics = Metrics(os.environ.get(REPORT_VARIABLE), os.environ.get(PROMETHEUS_VARIABLE))
+
+
+@contextmanager
+def recorded_run(details, profile_path=None):
+    # One import: the report is written when it ends, however it ends.
+    # cProfile only sees the calling thread, searches ahead and image downloads run on others.
+    profile_path = profile_path or os.environ.get(PROFILE_VARIABLE)
+    profiler = cProfile.Profile() if profile_path else None
+    if profiler is not None:
+        profiler.enable()
+    run = metrics.start_run() if metrics.enabled else None
+    try:
+        with metrics.timed("import"):
+            yield details
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        if run is not None:
+            metrics.write_report(details, run)
+            metrics.finish_run(run)
+        if profiler is not None:
+            make_parent(profile_path)
+            profiler.dump_stats(profile_path)
@@ -0,0 +1,34 @@
+SPOTIFY_MAX_ITEMS_PER_REQUEST = 100
+FLUSH_INTERVAL_MS = 15000
+
+
+class PlaylistAddBuffer:
+    def __init__(self, write_items, chunk_size=SPOTIFY_MAX_ITEMS_PER_REQUEST, on_written=None):
+        self.write_items = write_items
+        self.chunk_size = chunk_size
+        self.on_written = on_written
+        self.pending = []
+        self.pending_keys = []
+        self.written_count = 0
+        self.request_count = 0
+
+    def add(self, item, key=None):
+        # key identifies the item for on_written, e.g. the row it was chosen for
+        self.pending.append(item)
+        self.pending_keys.append(key)
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        # Items are only dropped from the buffer after the write succeeded,
+        # so a failed flush can be retried without losing or reordering items.
+        while self.pending:
+            chunk = self.pending[:self.chunk_size]
+            self.write_items(chunk)
+            keys = self.pending_keys[:len(chunk)]
+            del self.pending[:len(chunk)]
+            del self.pending_keys[:len(chunk)]
+            self.written_count += len(chunk)
+            self.request_count += 1
+            if self.on_written is not None:
+                self.on_written(keys)
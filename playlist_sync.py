@@ -0,0 +1,113 @@
+import bisect
+import json
+import os
+import tempfile
+from collections import Counter, namedtuple
+
+SYNC_DIR = os.path.join("cache", "sync")
+
+SyncPlan = namedtuple("SyncPlan", ["removals", "moves", "insertions"])
+
+
+class SyncMap:
+    # Row key -> item the last sync chose for it, rows that did not change are never searched again
+    def __init__(self, provider_name, playlist_id, directory=SYNC_DIR):
+        self.path = os.path.join(directory, f"{provider_name}_{playlist_id}.json")
+        self.items = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as sync_file:
+                for *key, item_id in json.load(sync_file)["rows"]:
+                    self.items[tuple(key)] = item_id
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def get(self, key):
+        return self.items.get(key)
+
+    def record(self, items):
+        # Songs chosen outside a sync, by hand from its review file
+        self.save({**self.items, **items})
+
+    def save(self, items):
+        # Replaces the whole map, rows that left the sheet are forgotten
+        self.items = dict(items)
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(descriptor, "w", encoding="utf-8") as sync_file:
+            json.dump({"rows": [[*key, item_id] for key, item_id in self.items.items()]}, sync_file, ensure_ascii=False)
+        os.replace(temporary_path, self.path)
+
+
+def longest_increasing(values):
+    # Indices of one longest strictly increasing subsequence, in O(n log n)
+    tail_values = []
+    tail_indices = []
+    previous = [None] * len(values)
+    for index, value in enumerate(values):
+        length = bisect.bisect_left(tail_values, value)
+        previous[index] = tail_indices[length - 1] if length else None
+        if length == len(tail_values):
+            tail_values.append(value)
+            tail_indices.append(index)
+        else:
+            tail_values[length] = value
+            tail_indices[length] = index
+    indices = set()
+    index = tail_indices[-1] if tail_indices else None
+    while index is not None:
+        indices.add(index)
+        index = previous[index]
+    return indices
+
+
+def plan_sync(current, desired, removes_every_copy=True):
+    # current holds (entry, item ID) in playlist order, desired the distinct item IDs in sheet order.
+    # Removals, then moves, then insertions, applied in this order, leave the playlist exactly as desired.
+    wanted = set(desired)
+    if removes_every_copy:
+        # An item listed twice is removed and added once again, Spotify removes every copy of a track anyway
+        counts = Counter(item_id for _, item_id in current)
+        removals = list(dict.fromkeys(
+            entry for entry, item_id in current if item_id not in wanted or counts[item_id] > 1
+        ))
+        kept = [(entry, item_id) for entry, item_id in current if item_id in wanted and counts[item_id] == 1]
+    else:
+        # Every copy is an entry of its own, the first one stays and only the others are removed
+        kept = []
+        removals = []
+        seen = set()
+        for entry, item_id in current:
+            if item_id in wanted and item_id not in seen:
+                seen.add(item_id)
+                kept.append((entry, item_id))
+            else:
+                removals.append(entry)
+
+    # The longest run of kept items that is already in sheet order stays, every other one is moved once
+    rank = {item_id: position for position, item_id in enumerate(desired)}
+    staying = longest_increasing([rank[item_id] for _, item_id in kept])
+    moving = {item_id for index, (_, item_id) in enumerate(kept) if index not in staying}
+    entries = {item_id: entry for entry, item_id in kept}
+    order = [item_id for _, item_id in kept]
+    moves = []
+    sheet_order = sorted(order, key=rank.get)
+    for position, item_id in enumerate(sheet_order):
+        if item_id not in moving:
+            continue
+        from_position = order.index(item_id)
+        del order[from_position]
+        to_position = order.index(sheet_order[position - 1]) + 1 if position else 0
+        order.insert(to_position, item_id)
+        moves.append((entries[item_id], item_id, from_position, to_position))
+
+    # New items are inserted in runs, left to right every position is already final
+    insertions = []
+    for position, item_id in enumerate(desired):
+        if item_id in entries:
+            continue
+        if insertions and insertions[-1][0] + len(insertions[-1][1]) == position:
+            insertions[-1][1].append(item_id)
+        else:
+            insertions.append((position, [item_id]))
+    return SyncPlan(removals, moves, insertions)
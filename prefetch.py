@@ -0,0 +1,48 @@
+from concurrent.futures import ThreadPoolExecutor
+from image_loader import prefetch_image
+
+LOOKAHEAD_DEPTH = 3
+MAX_LOOKAHEAD_DEPTH = 10
+
+
+class SearchPrefetcher:
+    def __init__(self, search, image_urls, depth=LOOKAHEAD_DEPTH):
+        self.search = search
+        self.image_urls = image_urls
+        self.depth = depth
+        self.executor = ThreadPoolExecutor(max_workers=max(depth, 1), thread_name_prefix="prefetch")
+        # row index -> (query, future)
+        self.pending = {}
+
+    def fetch(self, query):
+        results = self.search(query)
+        for url in self.image_urls(results):
+            prefetch_image(url)
+        return results
+
+    def advance(self, index, queries):
+        # Rows before the current one were decided already, their results are not needed
+        for row in [row for row in self.pending if row < index]:
+            self.discard(row)
+        for row in range(index + 1, min(index + 1 + self.depth, len(queries))):
+            if row not in self.pending:
+                self.pending[row] = (queries[row], self.executor.submit(self.fetch, queries[row]))
+
+    def get(self, index, query, force_refresh=False):
+        query_and_future = self.pending.pop(index, None)
+        if query_and_future is not None:
+            prefetched_query, future = query_and_future
+            if prefetched_query == query and not force_refresh:
+                return future.result()
+            future.cancel()
+        return self.search(query, force_refresh)
+
+    def discard(self, index):
+        query_and_future = self.pending.pop(index, None)
+        if query_and_future is not None:
+            query_and_future[1].cancel()
+
+    def close(self):
+        for row in list(self.pending):
+            self.discard(row)
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,164 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from metrics import metrics
+
+# requests per second and burst size, below what the services start throttling at
+RATE_LIMITS = {
+    "spotify": (8.0, 16),
+    "youtube": (5.0, 10),
+    "images": (20.0, 20),
+}
+MIN_RATE = 0.5
+RATE_RECOVERY = 0.1
+MAX_RETRIES = 6
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+# A longer Retry-After means the account is blocked for now, waiting would only look like a hang
+MAX_RETRY_AFTER = 300.0
+
+
+def parse_retry_after(value):
+    # Retry-After is either a number of seconds or an HTTP date
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt):
+    # Full jitter, so threads that failed together do not retry together
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # Takes a token right away, possibly going negative, and sleeps off the debt outside the lock
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = max(-self.tokens / self.rate, self.paused_until - now, 0.0)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def pause(self, seconds):
+        # Every caller waits, not only the one that was throttled, and the rate is halved
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = min(self.tokens, 0)
+            self.rate = max(self.rate / 2, MIN_RATE)
+
+    def recover(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + RATE_RECOVERY)
+
+
+class RequestScheduler:
+    # retry_advice(error) returns None when the error is final, otherwise (rate_limited, retry_after or None)
+    def __init__(self, name, rate, capacity, retry_advice=None):
+        self.name = name
+        self.bucket = TokenBucket(rate, capacity)
+        self.retry_advice = retry_advice or (lambda error: None)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+        self.longest_wait = 0.0
+        self.first_call = None
+
+    def call(self, function, idempotent=True, endpoint="request"):
+        # Rejected by a rate limit, a request had no effect and is always retried.
+        # Other failures are only retried when running the request twice does no harm.
+        endpoint = f"{self.name} {endpoint}"
+        attempt = 0
+        while True:
+            waited = self.bucket.acquire()
+            self.record_wait(waited)
+            metrics.count("requests", endpoint)
+            metrics.observe(f"{self.name} queue wait", waited)
+            started = time.perf_counter()
+            try:
+                result = function()
+            except Exception as error:
+                metrics.observe(endpoint, time.perf_counter() - started)
+                advice = self.retry_advice(error)
+                if advice is None or attempt >= MAX_RETRIES:
+                    raise
+                rate_limited, retry_after = advice
+                if not rate_limited and not idempotent:
+                    raise
+                if retry_after is not None and retry_after > MAX_RETRY_AFTER:
+                    raise
+                delay = retry_after if retry_after is not None else backoff_delay(attempt)
+                with self.lock:
+                    self.retries += 1
+                    self.throttled += rate_limited
+                metrics.count("retries", endpoint)
+                if rate_limited:
+                    self.bucket.pause(delay)
+                else:
+                    time.sleep(delay)
+                attempt += 1
+                continue
+            metrics.observe(endpoint, time.perf_counter() - started)
+            self.bucket.recover()
+            return result
+
+    def record_wait(self, waited):
+        with self.lock:
+            if self.first_call is None:
+                self.first_call = time.monotonic()
+            self.calls += 1
+            self.total_wait += waited
+            self.longest_wait = max(self.longest_wait, waited)
+
+    def throughput(self):
+        with self.lock:
+            if self.first_call is None:
+                return 0.0
+            return self.calls / max(time.monotonic() - self.first_call, 1e-3)
+
+    def stats(self):
+        average_wait = self.total_wait / self.calls if self.calls else 0.0
+        return (
+            f"{self.name} requests: {self.calls} calls, {self.throughput():.1f}/s, "
+            f"{self.retries} retries ({self.throttled} throttled), "
+            f"queue wait {average_wait:.2f}s average, {self.longest_wait:.2f}s longest"
+        )
+
+
+schedulers = {}
+schedulers_lock = threading.Lock()
+
+
+def get_scheduler(name, retry_advice=None):
+    with schedulers_lock:
+        if name not in schedulers:
+            rate, capacity = RATE_LIMITS[name]
+            schedulers[name] = RequestScheduler(name, rate, capacity, retry_advice)
+        return schedulers[name]
+
+
+def scheduler_stats():
+    with schedulers_lock:
+        return [scheduler.stats() for scheduler in schedulers.values() if scheduler.calls]
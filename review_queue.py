@@ -0,0 +1,111 @@
+import json
+import os
+import re
+import threading
+
+REVIEW_DIR = "review"
+UNSAFE_FILE_CHARACTERS = re.compile(r"[^\w-]+")
+# The importers of --provider both update one index
+review_index_lock = threading.Lock()
+
+
+def review_path(provider_name, playlist_id, directory=REVIEW_DIR):
+    # One file per playlist, "Load review file" adds its songs to that playlist
+    return os.path.join(directory, f"{provider_name}_{playlist_id}.jsonl")
+
+
+def review_index_path(playlist_name, directory=REVIEW_DIR):
+    # Written by --provider both, it names the review file of every service, either GUI opens it
+    return os.path.join(directory, f"both_{UNSAFE_FILE_CHARACTERS.sub('_', playlist_name)}.jsonl")
+
+
+def add_to_review_index(index_path, provider_name, path):
+    with review_index_lock:
+        try:
+            entries = [entry for entry in read_entries(index_path) if entry["provider"] != provider_name]
+        except FileNotFoundError:
+            entries = []
+        entries.append({"provider": provider_name, "review_file": os.path.relpath(path, os.path.dirname(index_path))})
+        with open(index_path, "w", encoding="utf-8") as index_file:
+            for entry in entries:
+                index_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+class ReviewQueue:
+    # An import adds to the file of its playlist, a sync replaces it because it searches every unresolved row again
+    def __init__(self, directory, provider_name, playlist_id, replace=False, index_path=None):
+        self.provider_name = provider_name
+        self.playlist_id = playlist_id
+        self.count = 0
+        self.path = review_path(provider_name, playlist_id, directory)
+        os.makedirs(directory, exist_ok=True)
+        self.file = open(self.path, "w" if replace else "a", encoding="utf-8")
+        if index_path is not None:
+            add_to_review_index(index_path, provider_name, self.path)
+
+    def add(self, artist, title, query, reason, best_id=None, score=None, key=None):
+        entry = {
+            "provider": self.provider_name,
+            "playlist_id": self.playlist_id,
+            "artist": artist,
+            "title": title,
+            "query": query,
+            "reason": reason,
+            "best_id": best_id,
+            "score": score,
+        }
+        if key is not None:
+            # Row key of a sync, the song chosen by hand is remembered for the next sync
+            entry["key"] = list(key)
+        self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.count += 1
+
+    def close(self):
+        empty = self.file.tell() == 0
+        self.file.close()
+        if empty:
+            os.remove(self.path)
+
+
+def read_entries(path):
+    with open(path, "r", encoding="utf-8") as review_file:
+        return [json.loads(line) for line in review_file if line.strip()]
+
+
+def entry_song(entry):
+    return entry["provider"], entry["playlist_id"], entry["artist"], entry["title"]
+
+
+def resolve_review_file(path, provider_name):
+    # The review file of the service when path is the index of --provider both
+    for entry in read_entries(path):
+        if entry["provider"] == provider_name and "review_file" in entry:
+            review_file = os.path.join(os.path.dirname(path), entry["review_file"])
+            # Removed once every song in it was reviewed
+            return review_file if os.path.exists(review_file) else path
+    return path
+
+
+def load_review_file(path, provider_name):
+    entries = [entry for entry in read_entries(path) if entry["provider"] == provider_name and "review_file" not in entry]
+    if len({entry["playlist_id"] for entry in entries}) > 1:
+        raise ValueError("the file holds songs of several playlists, batch_import.py now writes one file per playlist to "
+                         f"'{REVIEW_DIR}'")
+    # An import appended again to the same playlist may list a song twice, the latest entry is kept
+    return list({entry_song(entry): entry for entry in entries}.values())
+
+
+def remove_reviewed(path, entries):
+    # Called when the review finished, songs a run wrote to the file in the meantime stay
+    reviewed = {entry_song(entry) for entry in entries}
+    try:
+        left = [entry for entry in read_entries(path) if entry_song(entry) not in reviewed]
+    except FileNotFoundError:
+        return
+    if not left:
+        os.remove(path)
+        return
+    with open(path, "w", encoding="utf-8") as review_file:
+        for entry in left:
+            review_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
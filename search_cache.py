@@ -0,0 +1,124 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from metrics import metrics
+
+SEARCH_CACHE_PATH = os.path.join("cache", "search.sqlite3")
+SEARCH_CACHE_TTL = 7 * 24 * 60 * 60
+SEARCH_CACHE_MAX_ENTRIES = 50000
+EVICT_INTERVAL = 500
+
+
+def normalize_query(query):
+    return " ".join(query.casefold().split())
+
+
+class SearchCache:
+    def __init__(self, path=SEARCH_CACHE_PATH, ttl=SEARCH_CACHE_TTL, max_entries=SEARCH_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.puts_since_evict = 0
+        self.lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        # Losing the last writes on a power cut is fine for a cache, a fsync per search is not
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS search_results ("
+                " key TEXT PRIMARY KEY,"
+                " response TEXT NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS search_results_last_used ON search_results (last_used)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS search_results_expires_at ON search_results (expires_at)"
+            )
+
+    def key(self, provider, query, market=None, limit=None):
+        return f"{provider}|{market or ''}|{limit or ''}|{normalize_query(query)}"
+
+    def get(self, provider, query, market=None, limit=None):
+        key = self.key(provider, query, market, limit)
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT response, expires_at FROM search_results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] < now:
+                return None
+            with self.connection:
+                self.connection.execute("UPDATE search_results SET last_used = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def contains(self, provider, query, market=None, limit=None):
+        # Unlike get this does not count as a use of the entry
+        key = self.key(provider, query, market, limit)
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT 1 FROM search_results WHERE key = ? AND expires_at >= ?", (key, time.time())
+            ).fetchone()
+        return row is not None
+
+    def put(self, provider, query, response, market=None, limit=None, ttl=None):
+        key = self.key(provider, query, market, limit)
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO search_results (key, response, expires_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(response), expires_at, now)
+            )
+            self.puts_since_evict += 1
+            if self.puts_since_evict >= EVICT_INTERVAL:
+                self.puts_since_evict = 0
+                self.evict(now)
+
+    def evict(self, now):
+        self.connection.execute("DELETE FROM search_results WHERE expires_at < ?", (now,))
+        count = self.connection.execute("SELECT COUNT(*) FROM search_results").fetchone()[0]
+        if count > self.max_entries:
+            self.connection.execute(
+                "DELETE FROM search_results WHERE key IN ("
+                " SELECT key FROM search_results ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    def search(self, provider, query, fetch, market=None, limit=None, bypass=False):
+        if not bypass:
+            response = self.get(provider, query, market, limit)
+            if response is not None:
+                self.hits += 1
+                metrics.count("cache_hits", f"{provider} search")
+                return response
+        self.misses += 1
+        metrics.count("cache_misses", f"{provider} search")
+        response = fetch()
+        self.put(provider, query, response, market, limit)
+        return response
+
+    def stats(self):
+        total = self.hits + self.misses
+        ratio = self.hits / total if total else 0.0
+        return f"Search cache: {self.hits} hits, {self.misses} misses ({ratio:.0%} hit ratio)"
+
+
+search_cache = None
+search_cache_lock = threading.Lock()
+
+
+def get_search_cache():
+    global search_cache
+    with search_cache_lock:
+        if search_cache is None:
+            search_cache = SearchCache()
+        return search_cache
@@ -0,0 +1,26 @@
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QApplication, QProgressDialog
+from sheet_reader import iter_songs
+
+
+def load_songs(parent, file_name):
+    progress_dialog = QProgressDialog("Loading songs...", "Cancel", 0, 0, parent)
+    progress_dialog.setWindowModality(Qt.WindowModal)
+    progress_dialog.setMinimumDuration(500)
+
+    def show_progress(done, total):
+        if total:
+            progress_dialog.setMaximum(total)
+            progress_dialog.setValue(min(done, total))
+        progress_dialog.setLabelText(f"Loading songs... {done} rows read")
+        QApplication.processEvents()
+
+    songs = []
+    try:
+        for song in iter_songs(file_name, show_progress):
+            if progress_dialog.wasCanceled():
+                return None
+            songs.append(song)
+    finally:
+        progress_dialog.close()
+    return songs
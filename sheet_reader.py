@@ -0,0 +1,108 @@
+import codecs
+import csv
+import os
+import re
+from collections import namedtuple
+from metrics import metrics
+
+SHEET_FILE_FILTER = "Song lists (*.xlsx *.xlsm *.csv *.tsv *.txt)"
+PROGRESS_INTERVAL = 1000
+CHUNK_SIZE = 1 << 20
+
+SongRow = namedtuple("SongRow", ["artist", "title", "extra"])
+# "3:45", "1:02:03", or a time cell of excel ("00:03:45"), and seconds only with a unit
+DURATION = re.compile(r"(?:(\d+):)?(\d{1,2}):([0-5]\d)(?:\.\d+)?")
+SECONDS = re.compile(r"(\d+(?:\.\d+)?)\s*(?:s|sec|secs|seconds)")
+
+
+def cell_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def to_song_row(values):
+    values = [cell_text(value) for value in values]
+    while values and not values[-1]:
+        values.pop()
+    if len(values) < 2 or not (values[0] or values[1]):
+        return None
+    return SongRow(values[0], values[1], tuple(values[2:]))
+
+
+def row_duration(song):
+    # Seconds of the first duration column after the title, a bare number may as well be a year or the BPM
+    for cell in song.extra:
+        match = DURATION.fullmatch(cell)
+        if match:
+            hours, minutes, seconds = match.groups()
+            return int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds)
+        match = SECONDS.fullmatch(cell.casefold())
+        if match:
+            return float(match.group(1))
+    return None
+
+
+def iter_excel_rows(file_name):
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(file_name, read_only=True, data_only=True)
+    try:
+        worksheet = workbook.worksheets[0]
+        yield worksheet.max_row or 0
+        for values in worksheet.iter_rows(values_only=True):
+            yield values
+    finally:
+        workbook.close()
+
+
+def text_encoding(file_name):
+    # Excel saves csv files in the ANSI code page of the system, cp1252 in western Europe, unless asked for utf-8.
+    # The whole file is checked, the first umlaut may be in the last row.
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    with open(file_name, "rb") as sheet_file:
+        try:
+            for chunk in iter(lambda: sheet_file.read(CHUNK_SIZE), b""):
+                decoder.decode(chunk)
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            return "cp1252"
+    return "utf-8-sig"
+
+
+def iter_text_rows(file_name):
+    delimiter = "\t" if os.path.splitext(file_name)[1].lower() in (".tsv", ".txt") else None
+    # cp1252 leaves five bytes undefined, they are replaced instead of failing the whole sheet
+    with open(file_name, "r", encoding=text_encoding(file_name), errors="replace", newline="") as sheet_file:
+        if delimiter is None:
+            # Excel writes ";" instead of "," in many locales
+            first_line = sheet_file.readline()
+            sheet_file.seek(0)
+            delimiter = max(",;\t", key=first_line.count)
+        # The row count of a text file is unknown without reading it twice
+        yield None
+        for values in csv.reader(sheet_file, delimiter=delimiter):
+            yield values
+
+
+def iter_songs(file_name, progress=None):
+    # Rows are read lazily, one at a time, so memory does not grow with the file size.
+    # progress(done, total) is called every PROGRESS_INTERVAL rows, total may be None.
+    if os.path.splitext(file_name)[1].lower() in (".csv", ".tsv", ".txt"):
+        rows = iter_text_rows(file_name)
+    else:
+        rows = iter_excel_rows(file_name)
+    rows = metrics.timed_iter("sheet read", rows)
+    total = next(rows)
+    done = 0
+    for values in rows:
+        done += 1
+        if progress is not None and done % PROGRESS_INTERVAL == 0:
+            progress(done, total)
+        song = to_song_row(values)
+        if song is not None:
+            yield song
+    if progress is not None:
+        progress(done, done)
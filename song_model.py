@@ -0,0 +1,72 @@
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt
+from PyQt5.QtGui import QColor
+from sheet_reader import SongRow
+
+PENDING, MATCHED, SKIPPED, ADDED, DUPLICATE, PRESENT = range(6)
+STATUS_NAMES = ["pending", "matched", "skipped", "added", "duplicate", "in playlist"]
+STATUS_COLORS = {
+    MATCHED: QColor("#fff3c4"), SKIPPED: QColor("#f8d7da"), ADDED: QColor("#d4edda"),
+    DUPLICATE: QColor("#e2e3e5"), PRESENT: QColor("#e2e3e5"),
+}
+
+COLUMN_ARTIST, COLUMN_TITLE, COLUMN_STATUS = range(3)
+HEADERS = ["Interpret", "Titel", "Status"]
+
+
+class SongTableModel(QAbstractTableModel):
+    # One list per column instead of an item object per cell, the view only asks for visible rows
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.artists = []
+        self.titles = []
+        self.extras = []
+        self.statuses = bytearray()
+
+    def set_songs(self, songs):
+        self.beginResetModel()
+        self.artists = []
+        self.titles = []
+        self.extras = []
+        for artist, title, extra in songs:
+            self.artists.append(artist)
+            self.titles.append(title)
+            self.extras.append(extra)
+        self.statuses = bytearray(len(self.artists))
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.artists)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(HEADERS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row, column = index.row(), index.column()
+        if role == Qt.DisplayRole:
+            if column == COLUMN_ARTIST:
+                return self.artists[row]
+            if column == COLUMN_TITLE:
+                return self.titles[row]
+            return STATUS_NAMES[self.statuses[row]]
+        if role == Qt.BackgroundRole and column == COLUMN_STATUS:
+            return STATUS_COLORS.get(self.statuses[row])
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return HEADERS[section]
+        return super().headerData(section, orientation, role)
+
+    def song(self, row):
+        return SongRow(self.artists[row], self.titles[row], self.extras[row])
+
+    def status(self, row):
+        return self.statuses[row]
+
+    def set_status(self, row, status):
+        self.statuses[row] = status
+        # Only the status cell of this row is repainted
+        index = self.index(row, COLUMN_STATUS)
+        self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.BackgroundRole])
@@ -1,40 +1,18 @@
 import sys
-import json
-import pandas as pd
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QVBoxLayout, QPushButton, QFileDialog,
-    QTableWidget, QTableWidgetItem, QInputDialog, QMessageBox, QDialog, QLabel, QDialogButtonBox, QWidget, QLineEdit, QTextEdit, QListWidget, QListWidgetItem
+    QTableView, QInputDialog, QMessageBox, QDialog, QLabel, QDialogButtonBox, QWidget, QLineEdit, QTextEdit, QListWidget, QListWidgetItem, QCheckBox,
+    QHBoxLayout, QSpinBox
 )
-from PyQt5.QtGui import QPixmap, QIcon
-from PyQt5.QtCore import Qt
-import requests
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
-
-
-
-def load_spotify_config():
-    try:
-        with open("spotify.json", "r") as config_file:
-            config = json.load(config_file)
-            return config
-    except FileNotFoundError:
-        print("spotify.json not found!")
-        sys.exit(1)
-    except json.JSONDecodeError:
-        print("spotify.json is no well-formed json!")
-        sys.exit(1)
-
-
-config = load_spotify_config()
-
-# Spotify-Authentifizierung
-sp = spotipy.Spotify(auth_manager=SpotifyOAuth(
-    client_id=config["client_id"],
-    client_secret=config["client_secret"],
-    redirect_uri=config["redirect_uri"],
-    scope=config["scope"]
-))
+from image_loader import ImageLoader
+from prefetch import LOOKAHEAD_DEPTH, MAX_LOOKAHEAD_DEPTH
+from review_queue import load_review_file, remove_reviewed, resolve_review_file
+from sheet_reader import SongRow, SHEET_FILE_FILTER
+from sheet_progress import load_songs
+from song_model import SongTableModel
+from journal import find_unfinished_journal
+from import_worker import ImportWorker, Choice, ASK_QUESTION, CHOOSE, SKIP, SEARCH, STOP, FINISHED, FAILED
+from import_progress import ImportProgress
 
 
 class SearchWizard(QDialog):
@@ -42,6 +20,7 @@ class SearchWizard(QDialog):
         super().__init__(parent)
         self.setWindowTitle("Manual Songsearch")
         self.updated_query = query
+        self.force_refresh = False
 
         layout = QVBoxLayout(self)
         layout.addWidget(QLabel(f"Query: {query}"))
@@ -50,6 +29,9 @@ class SearchWizard(QDialog):
         self.query_input.setText(query)
         layout.addWidget(self.query_input)
 
+        self.refresh_checkbox = QCheckBox("Ignore cached results", self)
+        layout.addWidget(self.refresh_checkbox)
+
         button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
         button_box.accepted.connect(self.accept)
         button_box.rejected.connect(self.reject)
@@ -57,14 +39,16 @@ class SearchWizard(QDialog):
 
     def accept(self):
         self.updated_query = self.query_input.text()
+        self.force_refresh = self.refresh_checkbox.isChecked()
         super().accept()
 
 
 class SongWizard(QDialog):
-    def __init__(self, song, search_results, parent=None):
+    def __init__(self, song, search_results, scores=None, parent=None):
         super().__init__(parent)
         self.setWindowTitle("Choose Song")
         self.selected_uri = None
+        self.stop_requested = False
 
         layout = QVBoxLayout(self)
         layout.addWidget(QLabel(f"Song: {song}"))
@@ -72,24 +56,30 @@ class SongWizard(QDialog):
         self.result_list = QListWidget(self)
         self.result_list.setSelectionMode(QListWidget.SingleSelection)
 
+        from spotify_provider import smallest_cover_url
+        self.image_loader = ImageLoader(self.result_list)
+
         self.search_results = search_results
-        for result in search_results:
-            item = QListWidgetItem(f"{result['name']} - {', '.join(artist['name'] for artist in result['artists'])}")
-            album_cover_url = result['album']['images'][1]['url'] if result['album']['images'] else None
-            if album_cover_url:
-                response = requests.get(album_cover_url)
-                pixmap = QPixmap()
-                pixmap.loadFromData(response.content)
-                album_cover_label = QLabel(self)
-                album_cover_label.setPixmap(pixmap.scaled(64, 64, Qt.KeepAspectRatio))
-                item.setIcon(QIcon(pixmap))
+        for row, result in enumerate(search_results):
+            text = f"{result['name']} - {', '.join(artist['name'] for artist in result['artists'])}"
+            if scores is not None:
+                text += f" ({scores[row]:.0%} match)"
+            item = QListWidgetItem(text)
             self.result_list.addItem(item)
+            album_cover_url = smallest_cover_url(result['album']['images'])
+            if album_cover_url:
+                self.image_loader.load(row, album_cover_url)
+
+        if scores is not None and len(scores):
+            self.result_list.setCurrentRow(int(scores.argmax()))
 
         layout.addWidget(self.result_list)
 
         button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
         button_box.accepted.connect(self.accept)
         button_box.rejected.connect(self.reject)
+        stop_button = button_box.addButton("Stop import", QDialogButtonBox.DestructiveRole)
+        stop_button.clicked.connect(self.stop_import)
         layout.addWidget(button_box)
 
     def accept(self):
@@ -99,6 +89,10 @@ class SongWizard(QDialog):
             self.selected_uri = self.search_results[index]['uri']
         super().accept()
 
+    def stop_import(self):
+        self.stop_requested = True
+        self.reject()
+
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -106,106 +100,185 @@ class MainWindow(QMainWindow):
         self.setWindowTitle("Spotify Playlist Manager")
         self.setGeometry(100, 100, 600, 400)
 
-        self.song_data = None
-        self.skipped_songs = []
+        self.target_playlist_id = None
+        self.sync_keys = None
+        self.review_entries = None
+        self.sheet_path = None
+        self.import_worker = None
+        self.provider = None
 
         central_widget = QWidget(self)
         self.setCentralWidget(central_widget)
 
         layout = QVBoxLayout()
 
-        self.song_table_widget = QTableWidget(self)
-        self.song_table_widget.setColumnCount(2)
-        self.song_table_widget.setHorizontalHeaderLabels(["Interpret", "Titel"])
-        self.song_table_widget.setColumnWidth(0,300)
-        self.song_table_widget.setColumnWidth(1,400)
-        layout.addWidget(self.song_table_widget)
+        self.song_model = SongTableModel(self)
+        self.song_table_view = QTableView(self)
+        self.song_table_view.setModel(self.song_model)
+        self.song_table_view.setColumnWidth(0,300)
+        self.song_table_view.setColumnWidth(1,400)
+        layout.addWidget(self.song_table_view)
+
+        self.load_button = QPushButton("Import Excel")
+        self.load_button.clicked.connect(self.load_excel)
+        layout.addWidget(self.load_button)
+
+        self.review_button = QPushButton("Load review file")
+        self.review_button.clicked.connect(self.load_review)
+        layout.addWidget(self.review_button)
 
-        load_button = QPushButton("Import Excel")
-        load_button.clicked.connect(self.load_excel)
-        layout.addWidget(load_button)
+        lookahead_layout = QHBoxLayout()
+        lookahead_layout.addWidget(QLabel("Prefetch next songs:"))
+        self.lookahead_spinbox = QSpinBox(self)
+        self.lookahead_spinbox.setRange(0, MAX_LOOKAHEAD_DEPTH)
+        self.lookahead_spinbox.setValue(LOOKAHEAD_DEPTH)
+        lookahead_layout.addWidget(self.lookahead_spinbox)
+        layout.addLayout(lookahead_layout)
 
-        spotify_button = QPushButton("Add to Spotify")
-        spotify_button.clicked.connect(self.add_to_spotify)
-        layout.addWidget(spotify_button)
+        self.spotify_button = QPushButton("Add to Spotify")
+        self.spotify_button.clicked.connect(self.add_to_spotify)
+        layout.addWidget(self.spotify_button)
+
+        self.import_progress = ImportProgress(self)
+        layout.addWidget(self.import_progress)
 
         central_widget.setLayout(layout)
 
     def load_excel(self):
-        file_name, _ = QFileDialog.getOpenFileName(self, "Choose File", "", "Excel Files (*.xlsx *.xls)")
+        file_name, _ = QFileDialog.getOpenFileName(self, "Choose File", "", SHEET_FILE_FILTER)
         if not file_name:
             return
 
         try:
-            self.song_data = pd.read_excel(file_name, header=None, engine='openpyxl')
-            
-            self.song_table_widget.setRowCount(len(self.song_data))
-
-            for row_idx, row in self.song_data.iterrows():
-                artist, title = row[0], row[1]
-                self.song_table_widget.setItem(row_idx, 0, QTableWidgetItem(artist))
-                self.song_table_widget.setItem(row_idx, 1, QTableWidgetItem(title))
+            songs = load_songs(self, file_name)
+            if songs is None:
+                return
+            self.song_model.set_songs(songs)
+            self.target_playlist_id = None
+            self.sync_keys = None
+            self.review_entries = None
+            self.sheet_path = file_name
 
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Error while loading excel file: {e}")
 
-    def add_to_spotify(self):
-        if self.song_data is None:
-            QMessageBox.warning(self, "Warning", "No excel file was loaded")
-            return
-
-        playlist_name, ok = QInputDialog.getText(self, "Create playlist", "Name of playlist:")
-        if not ok or not playlist_name:
+    def load_review(self):
+        file_name, _ = QFileDialog.getOpenFileName(self, "Choose File", "", "Review Files (*.jsonl)")
+        if not file_name:
             return
 
         try:
-            playlist = sp.user_playlist_create(sp.me()['id'], playlist_name)
-            playlist_id = playlist['id']
-
-            for row_idx in range(self.song_table_widget.rowCount()):
-                artist_item = self.song_table_widget.item(row_idx, 0)
-                title_item = self.song_table_widget.item(row_idx, 1)
-                
-                if artist_item and title_item:
-                    artist = artist_item.text()
-                    title = title_item.text()
-                    query = f"{artist} {title}"
-
-                    while True:
-                        search_results = sp.search(query, type='track', limit=5, market='DE')
-
-                        if not search_results['tracks']['items']:
-                            self.skipped_songs.append(query)
-                            break
-
-                        wizard = SongWizard(f"{artist} - {title}", search_results['tracks']['items'], self)
-                        if wizard.exec_() == QDialog.Accepted and wizard.selected_uri:
-                            sp.playlist_add_items(playlist_id, [wizard.selected_uri])
-                            break
-                        else:
-                            manual_search = QMessageBox.question(
-                                self, "Song skipped",
-                                "No matching song found. Do you want to search again?",
-                                QMessageBox.Yes | QMessageBox.No
-                            )
-                            if manual_search == QMessageBox.No:
-                                self.skipped_songs.append(query)
-                                break
-                            search_dialog = SearchWizard(query, self)
-                            if search_dialog.exec_() == QDialog.Accepted:
-                                query = search_dialog.updated_query
-                            else:
-                                self.skipped_songs.append(query)
-                                break
-
-            QMessageBox.information(self, "Success", f"Playlist '{playlist_name}' was created.")
-            self.show_skipped_songs()
+            file_name = resolve_review_file(file_name, "spotify")
+            entries = load_review_file(file_name, "spotify")
+            if not entries:
+                QMessageBox.information(self, "Info", "The review file contains no spotify songs.")
+                return
+            self.song_model.set_songs(SongRow(entry['artist'], entry['title'], ()) for entry in entries)
+            # Reviewed songs go into the playlist the batch import created
+            self.target_playlist_id = entries[0]['playlist_id']
+            self.sync_keys = [entry.get('key') for entry in entries]
+            self.review_entries = entries
+            self.sheet_path = file_name
 
         except Exception as e:
-            QMessageBox.critical(self, "Error", f"Error with spotify integration: {e}")
+            QMessageBox.critical(self, "Error", f"Error while loading review file: {e}")
 
-    def show_skipped_songs(self):
-        if not self.skipped_songs:
+    def add_to_spotify(self):
+        if self.song_model.rowCount() == 0:
+            QMessageBox.warning(self, "Warning", "No excel file was loaded")
+            return
+
+        state = find_unfinished_journal("spotify", self.sheet_path)
+        if state is not None:
+            resume = QMessageBox.question(
+                self, "Unfinished import",
+                f"The import into playlist '{state.playlist_name}' stopped after {len(state.decisions)} "
+                f"of {self.song_model.rowCount()} songs. Do you want to continue it?",
+                QMessageBox.Yes | QMessageBox.No
+            )
+            if resume == QMessageBox.No:
+                state = None
+
+        playlist_name = state.playlist_name if state is not None else None
+        if state is None and not self.target_playlist_id:
+            playlist_name, ok = QInputDialog.getText(self, "Create playlist", "Name of playlist:")
+            if not ok or not playlist_name:
+                return
+
+        self.import_worker = ImportWorker(
+            self.create_provider, self.song_model, self.sheet_path, playlist_name,
+            target_playlist_id=self.target_playlist_id, state=state, lookahead=self.lookahead_spinbox.value(),
+            sync_keys=self.sync_keys
+        )
+        self.import_worker.status_changed.connect(self.song_model.set_status)
+        self.set_import_running(True)
+        self.import_progress.start(self.import_worker, self.answer_input, self.import_finished)
+
+    def create_provider(self):
+        # Runs on the import thread, spotipy and spotify.json are only loaded when the first import starts
+        if self.provider is None:
+            from spotify_provider import SpotifyProvider, create_spotify_client, load_spotify_config
+            self.provider = SpotifyProvider(create_spotify_client(load_spotify_config()))
+        return self.provider
+
+    def set_import_running(self, running):
+        for button in (self.load_button, self.review_button, self.spotify_button):
+            button.setEnabled(not running)
+
+    def answer_input(self, kind, payload):
+        if self.import_worker is None:
+            return
+        if kind == ASK_QUESTION:
+            answer = QMessageBox.question(self, "Spotify import", payload, QMessageBox.Yes | QMessageBox.No)
+            self.import_worker.reply(answer == QMessageBox.Yes)
+        else:
+            self.import_worker.reply(self.choose_song(payload))
+
+    def choose_song(self, request):
+        wizard = SongWizard(f"{request.artist} - {request.title}", request.items, request.scores, self)
+        if wizard.exec_() == QDialog.Accepted and wizard.selected_uri:
+            return Choice(CHOOSE, wizard.selected_uri)
+        if wizard.stop_requested:
+            return Choice(STOP)
+        manual_search = QMessageBox.question(
+            self, "Song skipped",
+            "No matching song found. Do you want to search again?",
+            QMessageBox.Yes | QMessageBox.No
+        )
+        if manual_search == QMessageBox.No:
+            return Choice(SKIP)
+        search_dialog = SearchWizard(request.query, self)
+        if search_dialog.exec_() == QDialog.Accepted:
+            return Choice(SEARCH, query=search_dialog.updated_query, force_refresh=search_dialog.force_refresh)
+        return Choice(SKIP)
+
+    def import_finished(self, outcome):
+        playlist_name = self.import_worker.playlist_name
+        self.import_worker = None
+        self.set_import_running(False)
+        for line in outcome.stats:
+            print(line)
+        if outcome.result == FAILED:
+            QMessageBox.critical(self, "Error", f"Error with spotify integration: {outcome.message}")
+            return
+        if outcome.result == FINISHED:
+            if self.review_entries is not None:
+                # Every song of the review got a decision, the file keeps only what a later run added
+                remove_reviewed(self.sheet_path, self.review_entries)
+            if playlist_name:
+                QMessageBox.information(self, "Success", f"Playlist '{playlist_name}' was created.")
+            else:
+                QMessageBox.information(self, "Success", "Reviewed songs were added to the playlist.")
+        elif outcome.message:
+            QMessageBox.information(self, "Import stopped", outcome.message)
+        self.show_skipped_songs(outcome.skipped_songs)
+
+    def closeEvent(self, event):
+        self.import_progress.wait()
+        super().closeEvent(event)
+
+    def show_skipped_songs(self, skipped_songs):
+        if not skipped_songs:
             QMessageBox.information(self, "Info", "No songs where skipped.")
             return
 
@@ -213,7 +286,7 @@ class MainWindow(QMainWindow):
         skipped_dialog.setWindowTitle("Skipped songs")
         layout = QVBoxLayout(skipped_dialog)
 
-        skipped_songs_text = ", ".join(self.skipped_songs)
+        skipped_songs_text = ", ".join(skipped_songs)
 
         text_edit = QTextEdit(skipped_dialog)
         text_edit.setPlainText(skipped_songs_text)
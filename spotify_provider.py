@@ -0,0 +1,206 @@
+import sys
+import re
+import json
+import requests
+import spotipy
+from spotipy.oauth2 import SpotifyOAuth
+from playlist_buffer import SPOTIFY_MAX_ITEMS_PER_REQUEST
+from search_cache import get_search_cache
+from request_scheduler import get_scheduler, parse_retry_after
+
+SEARCH_MARKET = 'DE'
+SEARCH_LIMIT = 5
+PLAYLIST_PAGE_SIZE = 100
+COVER_SIZE = 64
+TRACKS_PER_LOOKUP = 50
+TRACK_LINK = re.compile(r"(?:open\.spotify\.com/(?:intl-[a-z]+/)?track/|spotify:track:)([A-Za-z0-9]{22})")
+TRACK_ID = re.compile(r"[A-Za-z0-9]{22}")
+ISRC = re.compile(r"[A-Z]{2}-?[A-Z0-9]{3}-?[0-9]{2}-?[0-9]{5}")
+ISRC_PREFIX = "isrc:"
+
+
+def load_spotify_config():
+    try:
+        with open("spotify.json", "r") as config_file:
+            config = json.load(config_file)
+            return config
+    except FileNotFoundError:
+        sys.exit("spotify.json not found!")
+    except json.JSONDecodeError:
+        sys.exit("spotify.json is no well-formed json!")
+
+
+def create_spotify_client(config, open_browser=True):
+    # A plain session without spotipy's own retries, a 429 has to reach the scheduler with its Retry-After
+    return spotipy.Spotify(auth_manager=SpotifyOAuth(
+        client_id=config["client_id"],
+        client_secret=config["client_secret"],
+        redirect_uri=config["redirect_uri"],
+        scope=config["scope"],
+        open_browser=open_browser
+    ), requests_session=requests.Session())
+
+
+def retry_advice(error):
+    if isinstance(error, spotipy.SpotifyException):
+        if error.http_status == 429:
+            return True, parse_retry_after((error.headers or {}).get('Retry-After'))
+        if error.http_status >= 500:
+            return False, None
+        return None
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return False, None
+    return None
+
+
+def smallest_cover_url(images, min_size=COVER_SIZE):
+    if not images:
+        return None
+    large_enough = [image for image in images if (image.get('width') or 0) >= min_size]
+    if large_enough:
+        return min(large_enough, key=lambda image: image['width'])['url']
+    return max(images, key=lambda image: image.get('width') or 0)['url']
+
+
+def track_id_from_row(song):
+    # A link or URI may be in any column, a bare track ID or ISRC only in the extra ones
+    for cell in (song.artist, song.title, *song.extra):
+        match = TRACK_LINK.search(cell)
+        if match:
+            return f"spotify:track:{match.group(1)}"
+    for cell in song.extra:
+        if TRACK_ID.fullmatch(cell):
+            return f"spotify:track:{cell}"
+        if ISRC.fullmatch(cell.upper()):
+            return ISRC_PREFIX + cell.upper().replace("-", "")
+    return None
+
+
+def cover_urls(search_results):
+    urls = (smallest_cover_url(track['album']['images']) for track in search_results['tracks']['items'])
+    return [url for url in urls if url]
+
+
+class SpotifyProvider:
+    name = 'spotify'
+    write_chunk_size = SPOTIFY_MAX_ITEMS_PER_REQUEST
+    # Songs of the batch import scored together in one vectorized pass
+    score_batch_size = 500
+    # A playlist entry is the track URI, removing it takes every copy of the track
+    removes_every_copy = True
+
+    def __init__(self, sp):
+        self.sp = sp
+        self.scheduler = get_scheduler(self.name, retry_advice)
+
+    def refresh_credentials(self):
+        # spotipy's auth manager refreshes the token by itself
+        pass
+
+    def search(self, query, force_refresh=False):
+        return get_search_cache().search(
+            self.name, query,
+            lambda: self.scheduler.call(
+                lambda: self.sp.search(query, type='track', limit=SEARCH_LIMIT, market=SEARCH_MARKET), endpoint='search'
+            ),
+            market=SEARCH_MARKET, limit=SEARCH_LIMIT, bypass=force_refresh
+        )
+
+    def search_items(self, search_results):
+        return search_results['tracks']['items']
+
+    def item_id(self, item):
+        return item['uri']
+
+    def item_match_fields(self, item):
+        artists = ', '.join(artist['name'] for artist in item['artists'])
+        return artists, item['name'], item['duration_ms'] / 1000 if item.get('duration_ms') else None
+
+    def image_urls(self, search_results):
+        return cover_urls(search_results)
+
+    def direct_item_id(self, song):
+        return track_id_from_row(song)
+
+    def resolve_items(self, direct_ids):
+        # Track URIs are looked up 50 per request, an ISRC needs a search of its own but no dialog
+        direct_ids = list(dict.fromkeys(direct_ids))
+        uris = [direct_id for direct_id in direct_ids if not direct_id.startswith(ISRC_PREFIX)]
+        resolved = {}
+        for start in range(0, len(uris), TRACKS_PER_LOOKUP):
+            chunk = uris[start:start + TRACKS_PER_LOOKUP]
+            response = self.scheduler.call(lambda: self.sp.tracks(chunk, market=SEARCH_MARKET), endpoint='tracks')
+            for uri, track in zip(chunk, response['tracks']):
+                # Unknown IDs come back as None
+                if track is not None:
+                    resolved[uri] = track['uri']
+        for direct_id in direct_ids:
+            if direct_id.startswith(ISRC_PREFIX):
+                items = self.search_items(self.search(direct_id))
+                if items:
+                    resolved[direct_id] = items[0]['uri']
+        return resolved
+
+    def pages(self, page):
+        while page:
+            yield page
+            page = self.scheduler.call(lambda: self.sp.next(page), endpoint='next page') if page.get('next') else None
+
+    def playlist_entries(self, playlist_id):
+        # (entry, item ID, artist spellings, title) in playlist order, a Spotify entry is its track URI
+        first_page = self.scheduler.call(lambda: self.sp.playlist_items(
+            playlist_id, fields='items(track(uri,name,artists(name))),next',
+            limit=PLAYLIST_PAGE_SIZE, additional_types=('track',)
+        ), endpoint='playlist items')
+        for page in self.pages(first_page):
+            for entry in page['items']:
+                track = entry.get('track')
+                # Local files and removed tracks come without a track
+                if not track or not track.get('uri'):
+                    continue
+                artists = [artist['name'] for artist in track['artists']]
+                yield track['uri'], track['uri'], [', '.join(artists)] + artists, track['name']
+
+    def playlist_songs(self, playlist_id):
+        for _, uri, artists, title in self.playlist_entries(playlist_id):
+            yield uri, artists, title
+
+    def find_playlist(self, name):
+        user_id = self.user_id()
+        for page in self.pages(self.scheduler.call(lambda: self.sp.current_user_playlists(limit=50), endpoint='playlists')):
+            for playlist in page['items']:
+                if playlist['name'] == name and playlist['owner']['id'] == user_id:
+                    return playlist['id']
+        return None
+
+    def user_id(self):
+        return self.scheduler.call(self.sp.me, endpoint='me')['id']
+
+    def create_playlist(self, name, description=''):
+        user_id = self.user_id()
+        playlist = self.scheduler.call(
+            lambda: self.sp.user_playlist_create(user_id, name, description=description), idempotent=False,
+            endpoint='playlist create'
+        )
+        return playlist['id']
+
+    def add_items(self, playlist_id, uris, position=None):
+        self.scheduler.call(
+            lambda: self.sp.playlist_add_items(playlist_id, uris, position=position), idempotent=False, endpoint='playlist add'
+        )
+
+    def remove_entries(self, playlist_id, uris):
+        # Every copy of a track goes, removing one that is already gone does no harm
+        for start in range(0, len(uris), SPOTIFY_MAX_ITEMS_PER_REQUEST):
+            chunk = uris[start:start + SPOTIFY_MAX_ITEMS_PER_REQUEST]
+            self.scheduler.call(
+                lambda: self.sp.playlist_remove_all_occurrences_of_items(playlist_id, chunk), endpoint='playlist remove'
+            )
+
+    def move_entry(self, playlist_id, uri, item_id, from_position, to_position):
+        # Spotify counts insert_before in the playlist as it was before the move
+        insert_before = to_position if to_position < from_position else to_position + 1
+        self.scheduler.call(
+            lambda: self.sp.playlist_reorder_items(playlist_id, from_position, insert_before), idempotent=False,
+            endpoint='playlist reorder'
+        )
@@ -1,51 +1,26 @@
 import sys
-import json
-import pandas as pd
+import html
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QVBoxLayout, QPushButton, QFileDialog,
-    QListWidget, QInputDialog, QComboBox, QMessageBox, QDialog, QLabel, QDialogButtonBox, QWidget, QTextEdit, QListWidgetItem, QLineEdit
+    QListWidget, QInputDialog, QComboBox, QMessageBox, QDialog, QLabel, QDialogButtonBox, QWidget, QTextEdit, QListWidgetItem, QLineEdit, QCheckBox,
+    QHBoxLayout, QSpinBox, QTableView
 )
-from PyQt5.QtGui import QPixmap, QIcon
-from PyQt5.QtCore import Qt
-import google_auth_oauthlib.flow
-import googleapiclient.discovery
-import googleapiclient.errors
-import requests
-from google.auth.transport.requests import Request
-import time
-
-def load_youtube_config():
-    try:
-        with open("youtube.json", "r") as config_file:
-            config = json.load(config_file)
-            return config
-    except FileNotFoundError:
-        print("Error: youtube.json not found")
-        sys.exit(1)
-    except json.JSONDecodeError:
-        print("Error: youtube.json has no valid JSON.")
-        sys.exit(1)
-
-def authenticate_youtube(config):
-    client_secrets_file = "youtube.json"
-
-    flow = google_auth_oauthlib.flow.InstalledAppFlow.from_client_secrets_file(
-        client_secrets_file, scopes=["https://www.googleapis.com/auth/youtube.force-ssl"]
-    )
-
-    credentials = flow.run_local_server(port=0)
-
-    youtube = googleapiclient.discovery.build(
-        "youtube", "v3", credentials=credentials
-    )
-
-    return youtube, credentials
+from image_loader import ImageLoader
+from prefetch import LOOKAHEAD_DEPTH, MAX_LOOKAHEAD_DEPTH
+from review_queue import load_review_file, remove_reviewed, resolve_review_file
+from sheet_reader import SongRow, SHEET_FILE_FILTER
+from sheet_progress import load_songs
+from song_model import SongTableModel
+from journal import find_unfinished_journal
+from import_worker import ImportWorker, Choice, ASK_QUESTION, CHOOSE, SKIP, SEARCH, STOP, FINISHED, STOPPED, FAILED
+from import_progress import ImportProgress
 
 class SearchWizard(QDialog):
     def __init__(self, query, parent=None):
         super().__init__(parent)
         self.setWindowTitle("Manual video search")
         self.updated_query = query
+        self.force_refresh = False
 
         layout = QVBoxLayout(self)
         layout.addWidget(QLabel(f"Query: {query}"))
@@ -54,6 +29,9 @@ class SearchWizard(QDialog):
         self.query_input.setText(query)
         layout.addWidget(self.query_input)
 
+        self.refresh_checkbox = QCheckBox("Ignore cached results", self)
+        layout.addWidget(self.refresh_checkbox)
+
         button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
         button_box.accepted.connect(self.accept)
         button_box.rejected.connect(self.reject)
@@ -61,13 +39,15 @@ class SearchWizard(QDialog):
 
     def accept(self):
         self.updated_query = self.query_input.text()
+        self.force_refresh = self.refresh_checkbox.isChecked()
         super().accept()
 
 class VideoWizard(QDialog):
-    def __init__(self, video, search_results, parent=None):
+    def __init__(self, video, search_results, scores=None, parent=None):
         super().__init__(parent)
         self.setWindowTitle("Select video")
         self.selected_video_id = None
+        self.stop_requested = False
 
         layout = QVBoxLayout(self)
         layout.addWidget(QLabel(f"Video: {video}"))
@@ -75,24 +55,29 @@ class VideoWizard(QDialog):
         self.result_list = QListWidget(self)
         self.result_list.setSelectionMode(QListWidget.SingleSelection)
 
+        self.image_loader = ImageLoader(self.result_list)
+
         self.search_results = search_results
-        for result in search_results:
-            item = QListWidgetItem(f"{result['snippet']['title']}")
-            thumbnail_url = result['snippet']['thumbnails']['high']['url'] if result['snippet']['thumbnails'] else None
-            if thumbnail_url:
-                response = requests.get(thumbnail_url)
-                pixmap = QPixmap()
-                pixmap.loadFromData(response.content)
-                thumbnail_label = QLabel(self)
-                thumbnail_label.setPixmap(pixmap.scaled(64, 64, Qt.KeepAspectRatio))
-                item.setIcon(QIcon(pixmap))
+        for row, result in enumerate(search_results):
+            text = html.unescape(result['snippet']['title'])
+            if scores is not None:
+                text += f" ({scores[row]:.0%} match)"
+            item = QListWidgetItem(text)
             self.result_list.addItem(item)
+            thumbnail_url = result['snippet']['thumbnails'].get('default', {}).get('url')
+            if thumbnail_url:
+                self.image_loader.load(row, thumbnail_url)
+
+        if scores is not None and len(scores):
+            self.result_list.setCurrentRow(int(scores.argmax()))
 
         layout.addWidget(self.result_list)
 
         button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
         button_box.accepted.connect(self.accept)
         button_box.rejected.connect(self.reject)
+        stop_button = button_box.addButton("Stop import", QDialogButtonBox.DestructiveRole)
+        stop_button.clicked.connect(self.stop_import)
         layout.addWidget(button_box)
 
     def accept(self):
@@ -102,127 +87,197 @@ class VideoWizard(QDialog):
             self.selected_video_id = self.search_results[index]['id']['videoId']
         super().accept()
 
+    def stop_import(self):
+        self.stop_requested = True
+        self.reject()
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("YouTube Playlist Manager")
         self.setGeometry(100, 100, 600, 400)
 
-        self.song_data = None
-        self.skipped_songs = [] 
+        self.target_playlist_id = None
+        self.sync_keys = None
+        self.review_entries = None
+        self.sheet_path = None
+        self.import_worker = None
 
         central_widget = QWidget(self)
         self.setCentralWidget(central_widget)
 
         layout = QVBoxLayout()
-        self.song_list_widget = QListWidget(self)
-        layout.addWidget(self.song_list_widget)
-
-        load_button = QPushButton("Load excel file")
-        load_button.clicked.connect(self.load_excel)
-        layout.addWidget(load_button)
-
-        youtube_button = QPushButton("Add to youtube")
-        youtube_button.clicked.connect(self.add_to_youtube)
-        layout.addWidget(youtube_button)
+        self.song_model = SongTableModel(self)
+        self.song_table_view = QTableView(self)
+        self.song_table_view.setModel(self.song_model)
+        self.song_table_view.setColumnWidth(0, 300)
+        self.song_table_view.setColumnWidth(1, 400)
+        layout.addWidget(self.song_table_view)
+
+        self.load_button = QPushButton("Load excel file")
+        self.load_button.clicked.connect(self.load_excel)
+        layout.addWidget(self.load_button)
+
+        self.review_button = QPushButton("Load review file")
+        self.review_button.clicked.connect(self.load_review)
+        layout.addWidget(self.review_button)
+
+        lookahead_layout = QHBoxLayout()
+        lookahead_layout.addWidget(QLabel("Prefetch next songs:"))
+        self.lookahead_spinbox = QSpinBox(self)
+        self.lookahead_spinbox.setRange(0, MAX_LOOKAHEAD_DEPTH)
+        self.lookahead_spinbox.setValue(LOOKAHEAD_DEPTH)
+        lookahead_layout.addWidget(self.lookahead_spinbox)
+        layout.addLayout(lookahead_layout)
+
+        self.youtube_button = QPushButton("Add to youtube")
+        self.youtube_button.clicked.connect(self.add_to_youtube)
+        layout.addWidget(self.youtube_button)
+
+        self.import_progress = ImportProgress(self)
+        layout.addWidget(self.import_progress)
 
         central_widget.setLayout(layout)
 
     def load_excel(self):
-        file_name, _ = QFileDialog.getOpenFileName(self, "Select excel file", "", "Excel Files (*.xlsx *.xls)")
+        file_name, _ = QFileDialog.getOpenFileName(self, "Select excel file", "", SHEET_FILE_FILTER)
         if not file_name:
             return
 
         try:
-            self.song_data = pd.read_excel(file_name, header=None, engine='openpyxl')
-            self.song_list_widget.clear()
-            for _, row in self.song_data.iterrows():
-                artist, title = row[0], row[1]
-                self.song_list_widget.addItem(f"{artist} - {title}")
+            songs = load_songs(self, file_name)
+            if songs is None:
+                return
+            self.song_model.set_songs(songs)
+            self.target_playlist_id = None
+            self.sync_keys = None
+            self.review_entries = None
+            self.sheet_path = file_name
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Error while loading excel file: {e}")
 
+    def load_review(self):
+        file_name, _ = QFileDialog.getOpenFileName(self, "Select review file", "", "Review Files (*.jsonl)")
+        if not file_name:
+            return
+
+        try:
+            file_name = resolve_review_file(file_name, "youtube")
+            entries = load_review_file(file_name, "youtube")
+            if not entries:
+                QMessageBox.information(self, "Info", "The review file contains no youtube songs.")
+                return
+            self.song_model.set_songs(SongRow(entry["artist"], entry["title"], ()) for entry in entries)
+            # Reviewed songs go into the playlist the batch import created
+            self.target_playlist_id = entries[0]["playlist_id"]
+            self.sync_keys = [entry.get("key") for entry in entries]
+            self.review_entries = entries
+            self.sheet_path = file_name
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Error while loading review file: {e}")
+
     def add_to_youtube(self):
-        if self.song_data is None:
+        if self.song_model.rowCount() == 0:
             QMessageBox.warning(self, "Warning", "No excel file loaded.")
             return
 
-        playlist_name, ok = QInputDialog.getText(self, "Create playlist", "Name of playlist:")
-        if not ok or not playlist_name:
+        state = find_unfinished_journal("youtube", self.sheet_path)
+        if state is not None:
+            resume = QMessageBox.question(
+                self, "Unfinished import",
+                f"The import into playlist '{state.playlist_name}' stopped after {len(state.decisions)} "
+                f"of {self.song_model.rowCount()} songs. Do you want to continue it?",
+                QMessageBox.Yes | QMessageBox.No
+            )
+            if resume == QMessageBox.No:
+                state = None
+
+        playlist_name = state.playlist_name if state is not None else None
+        playlist_description = ""
+        if state is None and not self.target_playlist_id:
+            playlist_name, ok = QInputDialog.getText(self, "Create playlist", "Name of playlist:")
+            if not ok or not playlist_name:
+                return
+
+            playlist_description, ok = QInputDialog.getText(self, "Playlist descrpiton", "Description of playlist:")
+            if not ok or not playlist_description:
+                return
+
+        self.import_worker = ImportWorker(
+            self.create_provider, self.song_model, self.sheet_path, playlist_name,
+            playlist_description, self.target_playlist_id, state, self.lookahead_spinbox.value(), quota_plan=True,
+            sync_keys=self.sync_keys
+        )
+        self.import_worker.status_changed.connect(self.song_model.set_status)
+        self.set_import_running(True)
+        self.import_progress.start(self.import_worker, self.answer_input, self.import_finished)
+
+    def create_provider(self):
+        # Runs on the import thread, signing in may open the browser and the google SDK is only loaded here
+        from youtube_provider import YoutubeProvider, authenticate_youtube, load_youtube_config
+        return YoutubeProvider(*authenticate_youtube(load_youtube_config()))
+
+    def set_import_running(self, running):
+        for button in (self.load_button, self.review_button, self.youtube_button):
+            button.setEnabled(not running)
+
+    def answer_input(self, kind, payload):
+        if self.import_worker is None:
             return
-        
-        playlist_description, ok = QInputDialog.getText(self, "Playlist descrpiton", "Description of playlist:")
-        if not ok or not playlist_description:
+        if kind == ASK_QUESTION:
+            answer = QMessageBox.question(self, "YouTube import", payload, QMessageBox.Yes | QMessageBox.No)
+            self.import_worker.reply(answer == QMessageBox.Yes)
+        else:
+            self.import_worker.reply(self.choose_video(payload))
+
+    def choose_video(self, request):
+        wizard = VideoWizard(f"{request.artist} - {request.title}", request.items, request.scores, self)
+        if wizard.exec_() == QDialog.Accepted and wizard.selected_video_id:
+            return Choice(CHOOSE, wizard.selected_video_id)
+        if wizard.stop_requested:
+            return Choice(STOP)
+        manual_search = QMessageBox.question(
+            self, "Song skipped",
+            "No valid video found. Do you want to search again?",
+            QMessageBox.Yes | QMessageBox.No
+        )
+        if manual_search == QMessageBox.No:
+            return Choice(SKIP)
+        search_dialog = SearchWizard(request.query, self)
+        if search_dialog.exec_() == QDialog.Accepted:
+            return Choice(SEARCH, query=search_dialog.updated_query, force_refresh=search_dialog.force_refresh)
+        return Choice(SKIP)
+
+    def import_finished(self, outcome):
+        playlist_name = self.import_worker.playlist_name
+        self.import_worker = None
+        self.set_import_running(False)
+        for line in outcome.stats:
+            print(line)
+        if outcome.result == FAILED:
+            QMessageBox.critical(self, "Error", f"Error with youtube integration: {outcome.message}")
             return
-
-        config = load_youtube_config()
-        youtube, credentials = authenticate_youtube(config)
-
-        try:
-            playlist_request = youtube.playlists().insert(
-                part="snippet,status",
-                body={
-                    "snippet": {
-                        "title": playlist_name,
-                        "description": playlist_description,
-                    },
-                    "status": {
-                        "privacyStatus": "public"
-                    }
-                }
-            )
-            playlist_response = playlist_request.execute()
-            playlist_id = playlist_response["id"]
-            print(f"Playlist '{playlist_name}' created successful.")
-
-            for _, row in self.song_data.iterrows():
-                artist, title = row[0], row[1]
-                query = f"{artist} {title}"
-
-                while True:
-                    if credentials and credentials.expired and credentials.refresh_token:
-                        credentials.refresh(Request())
-
-                    search_results = youtube.search().list(
-                        part="snippet",
-                        q=query,
-                        type="video",
-                        maxResults=5
-                    ).execute()
-
-                    if not search_results['items']:
-                        self.skipped_songs.append(query)
-                        break
-
-                    wizard = VideoWizard(f"{artist} - {title}", search_results['items'], self)
-                    if wizard.exec_() == QDialog.Accepted and wizard.selected_video_id:
-                        video_id = wizard.selected_video_id
-                        self.add_video_to_playlist(youtube, playlist_id, video_id)
-                        break
-                    else:
-                        manual_search = QMessageBox.question(
-                            self, "Song skipped",
-                            "No valid video found. Do you want to search again?",
-                            QMessageBox.Yes | QMessageBox.No
-                        )
-                        if manual_search == QMessageBox.No:
-                            self.skipped_songs.append(query)
-                            break
-                        search_dialog = SearchWizard(query, self)
-                        if search_dialog.exec_() == QDialog.Accepted:
-                            query = search_dialog.updated_query
-                        else:
-                            self.skipped_songs.append(query)
-                            break
-
-            QMessageBox.information(self, "Success", f"Playlist '{playlist_name}' successful created.")
-            self.show_skipped_songs()
-
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Error with youtube integration: {e}")
-
-    def show_skipped_songs(self):
-        if not self.skipped_songs:
+        if outcome.result == STOPPED:
+            QMessageBox.information(self, "Quota used up", outcome.message)
+            return
+        if outcome.result == FINISHED:
+            if self.review_entries is not None:
+                # Every song of the review got a decision, the file keeps only what a later run added
+                remove_reviewed(self.sheet_path, self.review_entries)
+            if playlist_name:
+                QMessageBox.information(self, "Success", f"Playlist '{playlist_name}' successful created.")
+            else:
+                QMessageBox.information(self, "Success", "Reviewed songs were added to the playlist.")
+        elif outcome.message:
+            QMessageBox.information(self, "Import stopped", outcome.message)
+        self.show_skipped_songs(outcome.skipped_songs)
+
+    def closeEvent(self, event):
+        self.import_progress.wait()
+        super().closeEvent(event)
+
+    def show_skipped_songs(self, skipped_songs):
+        if not skipped_songs:
             QMessageBox.information(self, "Info", "No songs where skipped.")
             return
 
@@ -230,7 +285,7 @@ class MainWindow(QMainWindow):
         skipped_dialog.setWindowTitle("Skipped Songs")
         layout = QVBoxLayout(skipped_dialog)
 
-        skipped_songs_text = ", ".join(self.skipped_songs)
+        skipped_songs_text = ", ".join(skipped_songs)
 
         text_edit = QTextEdit(skipped_dialog)
         text_edit.setPlainText(skipped_songs_text)
@@ -243,20 +298,6 @@ class MainWindow(QMainWindow):
 
         skipped_dialog.exec_()
 
-    def add_video_to_playlist(self, youtube, playlist_id, video_id):
-        youtube.playlistItems().insert(
-            part="snippet",
-            body={
-                "snippet": {
-                    "playlistId": playlist_id,
-                    "resourceId": {
-                        "kind": "youtube#video",
-                        "videoId": video_id
-                    }
-                }
-            }
-        ).execute()
-
 # Hauptanwendung starten
 if __name__ == "__main__":
     app = QApplication(sys.argv)
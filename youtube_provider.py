@@ -0,0 +1,357 @@
+import sys
+import os
+import re
+import json
+import html
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+import google_auth_oauthlib.flow
+import googleapiclient.discovery
+import googleapiclient.errors
+import google_auth_httplib2
+import httplib2
+from google.auth.exceptions import RefreshError
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from search_cache import get_search_cache
+from request_scheduler import get_scheduler, parse_retry_after
+from metrics import metrics
+from youtube_quota import QuotaTracker, QuotaBudgetExceeded, SEARCH_COST, INSERT_COST, UPDATE_COST, DELETE_COST, LIST_COST, VIDEO_IDS_PER_LIST
+
+SEARCH_LIMIT = 5
+PLAYLIST_PAGE_SIZE = 50
+# quotaExceeded is not among them, the daily quota does not come back by waiting a few seconds
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+# The project quota is used up, the local count can be off when another client shares the project
+QUOTA_REASONS = {"quotaExceeded", "dailyLimitExceeded"}
+VIDEO_URL = re.compile(r"(?:youtube\.com/(?:watch\?(?:[^#\s]*&)?v=|shorts/|embed/|live/)|youtu\.be/)([A-Za-z0-9_-]{11})")
+VIDEO_ID = re.compile(r"[A-Za-z0-9_-]{11}")
+# 11 letters can just as well be a word like "Alternative", an ID almost always has one of these
+ID_CHARACTER = re.compile(r"[0-9_-]|.[A-Z]")
+SCOPES = ["https://www.googleapis.com/auth/youtube.force-ssl"]
+TOKEN_FILE = os.path.join("cache", "youtube_token.json")
+# Access tokens live an hour, they are renewed this long before so no request has to wait for it
+REFRESH_MARGIN = timedelta(minutes=5)
+REFRESH_RETRY_SECONDS = 60
+
+
+def load_youtube_config():
+    try:
+        with open("youtube.json", "r") as config_file:
+            config = json.load(config_file)
+            return config
+    except FileNotFoundError:
+        sys.exit("Error: youtube.json not found")
+    except json.JSONDecodeError:
+        sys.exit("Error: youtube.json has no valid JSON.")
+
+
+def utc_now():
+    # google-auth keeps the expiry as a naive UTC datetime
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class TokenStore:
+    # The OAuth token is kept between runs, so only the very first import needs a browser login
+    def __init__(self, path=TOKEN_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.credentials = None
+        self.refresher = None
+
+    def load(self):
+        try:
+            return Credentials.from_authorized_user_file(self.path, SCOPES)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, credentials):
+        # mkstemp creates the file readable by the user only, it contains the refresh token
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(descriptor, "w", encoding="utf-8") as token_file:
+            token_file.write(credentials.to_json())
+        os.replace(temporary_path, self.path)
+
+    def sign_in(self, client_secrets_file, open_browser=True):
+        credentials = self.load()
+        if credentials is not None and not credentials.valid and credentials.refresh_token:
+            try:
+                credentials.refresh(Request())
+            except RefreshError:
+                # Revoked or unused for too long, only a new login helps
+                credentials = None
+        if credentials is None or not credentials.valid:
+            flow = google_auth_oauthlib.flow.InstalledAppFlow.from_client_secrets_file(client_secrets_file, scopes=SCOPES)
+            credentials = flow.run_local_server(port=0, open_browser=open_browser)
+        self.save(credentials)
+        self.credentials = credentials
+        self.start_refresher()
+        return credentials
+
+    def refresh(self, credentials, force=False):
+        with self.lock:
+            # Another thread may have refreshed it while this one waited for the lock
+            if force or credentials.expiry is None or credentials.expiry - REFRESH_MARGIN <= utc_now():
+                credentials.refresh(Request())
+                self.save(credentials)
+
+    def start_refresher(self):
+        if self.refresher is None:
+            self.refresher = threading.Thread(target=self.keep_fresh, name="youtube-token", daemon=True)
+            self.refresher.start()
+
+    def keep_fresh(self):
+        while True:
+            credentials = self.credentials
+            if credentials.expiry is None:
+                return
+            time.sleep(max((credentials.expiry - REFRESH_MARGIN - utc_now()).total_seconds(), 0))
+            try:
+                self.refresh(credentials)
+            except Exception as e:
+                # Offline for now, refresh_credentials still refreshes before the next request
+                print(f"Refreshing the YouTube token failed: {e}")
+                time.sleep(REFRESH_RETRY_SECONDS)
+
+
+token_store = TokenStore()
+youtube_client = None
+youtube_client_lock = threading.Lock()
+
+
+def authenticate_youtube(config, open_browser=True):
+    # Built once per session, later imports need neither a login nor parsing the discovery document again
+    global youtube_client
+    with youtube_client_lock:
+        if youtube_client is None:
+            credentials = token_store.sign_in("youtube.json", open_browser)
+            # The discovery document that comes with the library, nothing is downloaded
+            youtube = googleapiclient.discovery.build(
+                "youtube", "v3", credentials=credentials, static_discovery=True
+            )
+            youtube_client = youtube, credentials
+        return youtube_client
+
+
+thread_http = threading.local()
+
+
+def execute_request(request, credentials):
+    # httplib2 is not thread safe, every worker thread needs its own connection
+    if threading.current_thread() is threading.main_thread():
+        return request.execute()
+    if getattr(thread_http, "credentials", None) is not credentials:
+        thread_http.credentials = credentials
+        thread_http.http = google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http())
+    return request.execute(http=thread_http.http)
+
+
+def error_reasons(error):
+    try:
+        return {entry.get("reason") for entry in json.loads(error.content)["error"].get("errors", [])}
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return set()
+
+
+def retry_advice(error):
+    if isinstance(error, googleapiclient.errors.HttpError):
+        if error.resp.status == 429 or RATE_LIMIT_REASONS & error_reasons(error):
+            return True, parse_retry_after(error.resp.get("retry-after"))
+        if error.resp.status >= 500:
+            return False, None
+        return None
+    if isinstance(error, (httplib2.HttpLib2Error, ConnectionError, TimeoutError)):
+        return False, None
+    return None
+
+
+def video_id_from_row(song):
+    # A link may be in any column, a bare ID only in the extra ones where no title can be taken for one
+    for cell in (song.artist, song.title, *song.extra):
+        match = VIDEO_URL.search(cell)
+        if match:
+            return match.group(1)
+    for cell in song.extra:
+        if VIDEO_ID.fullmatch(cell) and ID_CHARACTER.search(cell):
+            return cell
+    return None
+
+
+def thumbnail_urls(search_results):
+    urls = (result['snippet']['thumbnails'].get('default', {}).get('url') for result in search_results['items'])
+    return [url for url in urls if url]
+
+
+def split_video_title(title, channel_title):
+    # Music videos are usually titled "Artist - Title"
+    if " - " in title:
+        artist, title = title.split(" - ", 1)
+        return artist, title
+    return channel_title, title
+
+
+class YoutubeProvider:
+    name = "youtube"
+    # playlistItems().insert takes exactly one video per call
+    write_chunk_size = 1
+    # Small batches, so a quota budget is not used up by searches far ahead of their inserts
+    score_batch_size = 10
+    # Every copy of a video has a playlist item ID of its own and is removed alone
+    removes_every_copy = False
+
+    def __init__(self, youtube, credentials, quota=None):
+        self.youtube = youtube
+        self.credentials = credentials
+        self.scheduler = get_scheduler(self.name, retry_advice)
+        self.quota = quota or QuotaTracker()
+
+    def refresh_credentials(self):
+        # Normally the token store's background refresh got there first
+        if self.credentials and self.credentials.expired and self.credentials.refresh_token:
+            token_store.refresh(self.credentials)
+
+    def execute(self, request, cost, idempotent=True):
+        # Every attempt is charged, YouTube counts failed requests against the quota as well
+        endpoint = request.methodId.replace("youtube.", "", 1)
+
+        def send():
+            self.quota.spend(cost)
+            metrics.count("quota_units", f"{self.name} {endpoint}", cost)
+            return execute_request(request, self.credentials)
+        try:
+            return self.scheduler.call(send, idempotent, endpoint)
+        except googleapiclient.errors.HttpError as error:
+            reasons = QUOTA_REASONS & error_reasons(error)
+            if error.resp.status != 403 or not reasons:
+                raise
+            self.quota.exhausted()
+            raise QuotaBudgetExceeded(f"YouTube reports the daily quota as used up ({', '.join(sorted(reasons))}).") from error
+
+    def search(self, query, force_refresh=False):
+        return get_search_cache().search(
+            self.name, query,
+            lambda: self.execute(self.youtube.search().list(
+                part="snippet",
+                q=query,
+                type="video",
+                maxResults=SEARCH_LIMIT
+            ), SEARCH_COST),
+            limit=SEARCH_LIMIT, bypass=force_refresh
+        )
+
+    def is_cached(self, query):
+        return get_search_cache().contains(self.name, query, limit=SEARCH_LIMIT)
+
+    def search_items(self, search_results):
+        return search_results['items']
+
+    def item_id(self, item):
+        return item['id']['videoId']
+
+    def item_match_fields(self, item):
+        # Search snippets are HTML escaped
+        artist, title = split_video_title(
+            html.unescape(item['snippet']['title']), html.unescape(item['snippet'].get('channelTitle', ''))
+        )
+        return artist, title, None
+
+    def image_urls(self, search_results):
+        return thumbnail_urls(search_results)
+
+    def direct_item_id(self, song):
+        return video_id_from_row(song)
+
+    def resolve_items(self, video_ids):
+        # videos().list checks 50 IDs for 1 unit, a search costs 100
+        video_ids = list(dict.fromkeys(video_ids))
+        resolved = {}
+        for start in range(0, len(video_ids), VIDEO_IDS_PER_LIST):
+            response = self.execute(self.youtube.videos().list(
+                part="id", id=",".join(video_ids[start:start + VIDEO_IDS_PER_LIST]), maxResults=VIDEO_IDS_PER_LIST
+            ), LIST_COST)
+            resolved.update((item["id"], item["id"]) for item in response["items"])
+        return resolved
+
+    def pages(self, list_method, **parameters):
+        page_token = None
+        while True:
+            response = self.execute(list_method(maxResults=PLAYLIST_PAGE_SIZE, pageToken=page_token, **parameters), LIST_COST)
+            yield response
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                return
+
+    def playlist_entries(self, playlist_id):
+        # (playlist item ID, video ID, artist spellings, title) in playlist order
+        for page in self.pages(self.youtube.playlistItems().list, part="snippet", playlistId=playlist_id):
+            for item in page["items"]:
+                snippet = item["snippet"]
+                artist, title = split_video_title(snippet["title"], snippet.get("videoOwnerChannelTitle", ""))
+                yield item["id"], snippet["resourceId"]["videoId"], [artist], title
+
+    def playlist_songs(self, playlist_id):
+        for _, video_id, artists, title in self.playlist_entries(playlist_id):
+            yield video_id, artists, title
+
+    def find_playlist(self, name):
+        for page in self.pages(self.youtube.playlists().list, part="snippet", mine=True):
+            for playlist in page["items"]:
+                if playlist["snippet"]["title"] == name:
+                    return playlist["id"]
+        return None
+
+    def create_playlist(self, name, description=""):
+        playlist_response = self.execute(self.youtube.playlists().insert(
+            part="snippet,status",
+            body={
+                "snippet": {
+                    "title": name,
+                    "description": description,
+                },
+                "status": {
+                    "privacyStatus": "public"
+                }
+            }
+        ), INSERT_COST, idempotent=False)
+        return playlist_response["id"]
+
+    def add_items(self, playlist_id, video_ids, position=None):
+        for offset, video_id in enumerate(video_ids):
+            snippet = {
+                "playlistId": playlist_id,
+                "resourceId": {
+                    "kind": "youtube#video",
+                    "videoId": video_id
+                }
+            }
+            if position is not None:
+                snippet["position"] = position + offset
+            self.execute(self.youtube.playlistItems().insert(
+                part="snippet",
+                body={"snippet": snippet}
+            ), INSERT_COST, idempotent=False)
+
+    def remove_entries(self, playlist_id, playlist_item_ids):
+        # One playlist item per request, a repeated delete would fail on the item that is gone
+        for playlist_item_id in playlist_item_ids:
+            self.execute(self.youtube.playlistItems().delete(id=playlist_item_id), DELETE_COST, idempotent=False)
+
+    def move_entry(self, playlist_id, playlist_item_id, video_id, from_position, to_position):
+        self.execute(self.youtube.playlistItems().update(
+            part="snippet",
+            body={
+                "id": playlist_item_id,
+                "snippet": {
+                    "playlistId": playlist_id,
+                    "resourceId": {
+                        "kind": "youtube#video",
+                        "videoId": video_id
+                    },
+                    "position": to_position
+                }
+            }
+        ), UPDATE_COST)
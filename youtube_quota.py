@@ -0,0 +1,128 @@
+import json
+import math
+import os
+import tempfile
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from dedupe import DuplicateFilter, NEW
+
+QUOTA_FILE = os.path.join("cache", "youtube_quota.json")
+DAILY_QUOTA = 10000
+SEARCH_COST = 100
+INSERT_COST = 50
+UPDATE_COST = 50
+DELETE_COST = 50
+LIST_COST = 1
+VIDEO_IDS_PER_LIST = 50
+
+QuotaPlan = namedtuple("QuotaPlan", ["songs", "searches", "cached_searches", "video_ids", "units"])
+
+
+class QuotaBudgetExceeded(Exception):
+    pass
+
+
+def quota_day():
+    # The daily quota resets at midnight Pacific time
+    try:
+        from zoneinfo import ZoneInfo
+        now = datetime.now(ZoneInfo("America/Los_Angeles"))
+    except (ImportError, KeyError):
+        now = datetime.now(timezone(timedelta(hours=-8)))
+    return now.date().isoformat()
+
+
+class QuotaTracker:
+    # Units spent today, kept on disk because every run of the tool shares the same daily quota
+    def __init__(self, path=QUOTA_FILE, daily_quota=DAILY_QUOTA, budget=None):
+        self.path = path
+        self.daily_quota = daily_quota
+        self.lock = threading.Lock()
+        self.day = quota_day()
+        self.spent_today = 0
+        self.spent = 0
+        try:
+            with open(path, "r", encoding="utf-8") as quota_file:
+                saved = json.load(quota_file)
+            if saved.get("day") == self.day:
+                self.spent_today = saved.get("spent", 0)
+        except (OSError, ValueError):
+            pass
+        self.budget = self.remaining() if budget is None else budget
+
+    def remaining(self):
+        return max(self.daily_quota - self.spent_today, 0)
+
+    def spend(self, units):
+        # Called before a request is sent, the request is not made when it would pass the budget
+        with self.lock:
+            if self.spent + units > self.budget:
+                raise QuotaBudgetExceeded(
+                    f"Quota budget of {self.budget} units reached ({self.spent_today} of {self.daily_quota} used today)."
+                )
+            if quota_day() != self.day:
+                self.day = quota_day()
+                self.spent_today = 0
+            self.spent += units
+            self.spent_today += units
+            self.save()
+
+    def exhausted(self):
+        # YouTube refused a request for quota, later requests of this run are not sent at all
+        with self.lock:
+            self.spent_today = max(self.spent_today, self.daily_quota)
+            self.budget = min(self.budget, self.spent)
+            self.save()
+
+    def save(self):
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(descriptor, "w", encoding="utf-8") as quota_file:
+            json.dump({"day": self.day, "spent": self.spent_today}, quota_file)
+        os.replace(temporary_path, self.path)
+
+    def songs_left(self):
+        # A song that has to be searched costs a search and an insert
+        return max(self.budget - self.spent, 0) // (SEARCH_COST + INSERT_COST)
+
+    def stats(self):
+        return f"YouTube quota: {self.spent} units used by this import, {self.spent_today} of {self.daily_quota} today"
+
+
+def plan_quota(provider, songs, create_playlist=True):
+    # Estimate before the run: every distinct song is assumed to be found and inserted, every video ID to be valid
+    duplicate_filter = DuplicateFilter()
+    song_count = searches = cached_searches = video_ids = 0
+    for song in songs:
+        if duplicate_filter.classify(song.artist, song.title) != NEW:
+            continue
+        song_count += 1
+        if provider.direct_item_id(song) is not None:
+            video_ids += 1
+        elif provider.is_cached(f"{song.artist} {song.title}"):
+            cached_searches += 1
+        else:
+            searches += 1
+    units = (
+        searches * SEARCH_COST
+        + song_count * INSERT_COST
+        + math.ceil(video_ids / VIDEO_IDS_PER_LIST) * LIST_COST
+        + (INSERT_COST if create_playlist else 0)
+    )
+    return QuotaPlan(song_count, searches, cached_searches, video_ids, units)
+
+
+def describe_plan(plan, tracker):
+    text = (
+        f"{plan.songs} distinct songs: {plan.searches} searches, {plan.cached_searches} cached searches, "
+        f"{plan.video_ids} video IDs. Estimated cost: about {plan.units} quota units, "
+        f"{tracker.remaining()} of {tracker.daily_quota} left today."
+    )
+    if plan.units > tracker.budget:
+        text += (
+            f" The budget of {tracker.budget} units covers about {tracker.songs_left()} searched songs, "
+            f"the import stops there and can be continued later."
+        )
+    return text